@@ -1,220 +1,46 @@
-from typing import List, Dict, Optional
-from pydantic import BaseModel, ValidationError, validator, field_validator
+from typing import List, Dict, Optional, Union, Iterator, Sequence, Tuple
+from collections.abc import Sequence as SequenceABC
+from pydantic import BaseModel, ConfigDict, ValidationError, validator, field_validator, field_serializer, model_validator
 from enum import Enum
 
+import numpy as np
+
+from keypoint_schemas import COCO_WHOLEBODY, KEYPOINT_SCHEMAS, KeypointSchema, get_schema
+
 
 class Keypoints(BaseModel):
     """
-    Object representing all keypoints for a single bbx.
-    133 total keypoints (COCO whole-body).
-    Annotations given by: https://github.com/jin-s13/COCO-WholeBody/blob/master/data_format.md
+    Object representing all keypoints for a single bbx as (x, y, score) triplets.
+    Defaults to the 133 COCO whole-body keypoints. Keypoint names and the skeleton live in
+    the shared `keypoint_schemas` registry and are referenced by `schema_id`, never stored
+    per instance.
     """
 
-    keypoints: List[List[float, float, float]]
-    wholebody = {
-        "keypoints": {
-            0: "nose",
-            1: "left_eye",
-            2: "right_eye",
-            3: "left_ear",
-            4: "right_ear",
-            5: "left_shoulder",
-            6: "right_shoulder",
-            7: "left_elbow",
-            8: "right_elbow",
-            9: "left_wrist",
-            10: "right_wrist",
-            11: "left_hip",
-            12: "right_hip",
-            13: "left_knee",
-            14: "right_knee",
-            15: "left_ankle",
-            16: "right_ankle",
-            17: "left_big_toe",
-            18: "left_small_toe",
-            19: "left_heel",
-            20: "right_big_toe",
-            21: "right_small_toe",
-            22: "right_heel",
-            23: "face-0",
-            24: "face-1",
-            25: "face-2",
-            26: "face-3",
-            27: "face-4",
-            28: "face-5",
-            29: "face-6",
-            30: "face-7",
-            31: "face-8",
-            32: "face-9",
-            33: "face-10",
-            34: "face-11",
-            35: "face-12",
-            36: "face-13",
-            37: "face-14",
-            38: "face-15",
-            39: "face-16",
-            40: "face-17",
-            41: "face-18",
-            42: "face-19",
-            43: "face-20",
-            44: "face-21",
-            45: "face-22",
-            46: "face-23",
-            47: "face-24",
-            48: "face-25",
-            49: "face-26",
-            50: "face-27",
-            51: "face-28",
-            52: "face-29",
-            53: "face-30",
-            54: "face-31",
-            55: "face-32",
-            56: "face-33",
-            57: "face-34",
-            58: "face-35",
-            59: "face-36",
-            60: "face-37",
-            61: "face-38",
-            62: "face-39",
-            63: "face-40",
-            64: "face-41",
-            65: "face-42",
-            66: "face-43",
-            67: "face-44",
-            68: "face-45",
-            69: "face-46",
-            70: "face-47",
-            71: "face-48",
-            72: "face-49",
-            73: "face-50",
-            74: "face-51",
-            75: "face-52",
-            76: "face-53",
-            77: "face-54",
-            78: "face-55",
-            79: "face-56",
-            80: "face-57",
-            81: "face-58",
-            82: "face-59",
-            83: "face-60",
-            84: "face-61",
-            85: "face-62",
-            86: "face-63",
-            87: "face-64",
-            88: "face-65",
-            89: "face-66",
-            90: "face-67",
-            91: "left_hand_root",
-            92: "left_thumb1",
-            93: "left_thumb2",
-            94: "left_thumb3",
-            95: "left_thumb4",
-            96: "left_forefinger1",
-            97: "left_forefinger2",
-            98: "left_forefinger3",
-            99: "left_forefinger4",
-            100: "left_middle_finger1",
-            101: "left_middle_finger2",
-            102: "left_middle_finger3",
-            103: "left_middle_finger4",
-            104: "left_ring_finger1",
-            105: "left_ring_finger2",
-            106: "left_ring_finger3",
-            107: "left_ring_finger4",
-            108: "left_pinky_finger1",
-            109: "left_pinky_finger2",
-            110: "left_pinky_finger3",
-            111: "left_pinky_finger4",
-            112: "right_hand_root",
-            113: "right_thumb1",
-            114: "right_thumb2",
-            115: "right_thumb3",
-            116: "right_thumb4",
-            117: "right_forefinger1",
-            118: "right_forefinger2",
-            119: "right_forefinger3",
-            120: "right_forefinger4",
-            121: "right_middle_finger1",
-            122: "right_middle_finger2",
-            123: "right_middle_finger3",
-            124: "right_middle_finger4",
-            125: "right_ring_finger1",
-            126: "right_ring_finger2",
-            127: "right_ring_finger3",
-            128: "right_ring_finger4",
-            129: "right_pinky_finger1",
-            130: "right_pinky_finger2",
-            131: "right_pinky_finger3",
-            132: "right_pinky_finger4",
-        },
-        "skeleton": [
-            [15, 13],
-            [13, 11],
-            [16, 14],
-            [14, 12],
-            [11, 12],
-            [5, 11],
-            [6, 12],
-            [5, 6],
-            [5, 7],
-            [6, 8],
-            [7, 9],
-            [8, 10],
-            [1, 2],
-            [0, 1],
-            [0, 2],
-            [1, 3],
-            [2, 4],
-            [3, 5],
-            [4, 6],
-            [15, 17],
-            [15, 18],
-            [15, 19],
-            [16, 20],
-            [16, 21],
-            [16, 22],
-            [91, 92],
-            [92, 93],
-            [93, 94],
-            [94, 95],
-            [91, 96],
-            [96, 97],
-            [97, 98],
-            [98, 99],
-            [91, 100],
-            [100, 101],
-            [101, 102],
-            [102, 103],
-            [91, 104],
-            [104, 105],
-            [105, 106],
-            [106, 107],
-            [91, 108],
-            [108, 109],
-            [109, 110],
-            [110, 111],
-            [112, 113],
-            [113, 114],
-            [114, 115],
-            [115, 116],
-            [112, 117],
-            [117, 118],
-            [118, 119],
-            [119, 120],
-            [112, 121],
-            [121, 122],
-            [122, 123],
-            [123, 124],
-            [112, 125],
-            [125, 126],
-            [126, 127],
-            [127, 128],
-            [112, 129],
-            [129, 130],
-            [130, 131],
-            [131, 132],
-        ],
-    }
+    # estimators report undetected keypoints as NaN, keep them as `NaN` in JSON instead of `null`
+    model_config = ConfigDict(ser_json_inf_nan="constants")
+
+    schema_id: str = COCO_WHOLEBODY.schema_id
+    keypoints: List[Tuple[float, float, float]]
+
+    @field_validator("schema_id")
+    @classmethod
+    def known_schema(cls, v):
+        if v not in KEYPOINT_SCHEMAS:
+            raise ValueError(f"Unknown keypoint schema: {v}")
+        return v
+
+    @model_validator(mode="after")
+    def matches_schema(self):
+        if len(self.keypoints) != self.schema.num_keypoints:
+            raise ValueError(f"{self.schema_id} has {self.schema.num_keypoints} keypoints, got {len(self.keypoints)}")
+        return self
+
+    @property
+    def schema(self) -> KeypointSchema:
+        return get_schema(self.schema_id)
+
+    def to_array(self) -> np.ndarray:
+        return np.asarray(self.keypoints, dtype=np.float64).reshape(-1, 3)
 
 
 class Bbox(BaseModel):
@@ -231,7 +57,7 @@ class Bbox(BaseModel):
     width: float
     height: float
     confidence: float
-    keypoints: Optional[Keypoints]
+    keypoints: Optional[Keypoints] = None
 
 
 class Position(BaseModel):
@@ -340,7 +166,7 @@ class ActionAnnotation(BaseModel):
     contesting: Optional[str] = None
     ts: Optional[str] = None
 
-    @field_validator("*", pre=True)
+    @field_validator("*", mode="before")
     def empty_str_to_none(cls, v):
         if v == "":
             return None
@@ -357,14 +183,311 @@ class FrameAnnotation(BaseModel):
     tracklet: Optional[Tracklet] = None
 
 
+# column layout of the `bboxes` array held by a `FrameStore`
+BBOX_COLUMNS = ("frame_number", "player_id", "x", "y", "width", "height", "confidence")
+
+
+def _keypoints_row(keypoints: Optional[dict], schema_id: str) -> np.ndarray:
+    if not keypoints:
+        return np.full((get_schema(schema_id).num_keypoints, 3), np.nan)
+    return np.asarray(keypoints["keypoints"], dtype=np.float64).reshape(-1, 3)
+
+
+class FrameStore(SequenceABC):
+    """
+    Columnar, lazily materialized backend for `VideoAnnotation.frames`.
+    Bboxes for all frames are held in a single (n_bboxes, 7) array laid out as
+    `BBOX_COLUMNS`, with `bbox_offsets[i]:bbox_offsets[i + 1]` selecting the rows
+    of the i-th frame. `FrameAnnotation` objects are only built on access.
+    Positional indexing behaves like the old list; use `get` to look up by `frame_id`.
+    Keypoints, if any, are a (n_bboxes, n_keypoints, 3) array aligned with `bboxes`,
+    with all-NaN rows for bboxes that have no pose estimate, laid out as keypoint schema `schema_id`.
+    """
+
+    def __init__(
+        self,
+        frame_ids: np.ndarray,
+        bbox_offsets: np.ndarray,
+        bboxes: np.ndarray,
+        tracklets: Optional[Dict[int, Union[Tracklet, dict, None]]] = None,
+        tracklet_offset: int = 0,
+        keypoints: Optional[np.ndarray] = None,
+        schema_id: str = COCO_WHOLEBODY.schema_id,
+    ):
+        self.frame_ids = np.asarray(frame_ids, dtype=np.int64)
+        self.bbox_offsets = np.asarray(bbox_offsets, dtype=np.int64)
+        self.bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, len(BBOX_COLUMNS))
+        self.keypoints = None
+        if keypoints is not None:
+            self.keypoints = np.asarray(keypoints, dtype=np.float64).reshape(len(self.bboxes), -1, 3)
+        # keyed by the *source* frame number, `tracklet_offset` is subtracted on access
+        self.tracklets = tracklets or {}
+        self.tracklet_offset = tracklet_offset
+        self.schema_id = get_schema(schema_id).schema_id
+
+        assert len(self.bbox_offsets) == len(self.frame_ids) + 1, "bbox_offsets must have len(frame_ids) + 1 entries"
+        assert np.all(np.diff(self.frame_ids) > 0), "frame_ids must be strictly increasing"
+
+    @classmethod
+    def from_columns(
+        cls,
+        bboxes_dict: Dict[int, np.ndarray],
+        tracklets: Optional[Dict[int, Union[Tracklet, dict, None]]] = None,
+        keypoints_dict: Optional[Dict[int, np.ndarray]] = None,
+        schema_id: str = COCO_WHOLEBODY.schema_id,
+    ) -> "FrameStore":
+        """
+        Build a store from per-frame bbox arrays (rows laid out as `BBOX_COLUMNS`)
+        and a frame number -> `Tracklet` mapping, as produced by the loaders in
+        `construct_annotations`. `keypoints_dict` optionally maps frame number to a
+        (n_bboxes, n_keypoints, 3) array aligned with that frame's bbox rows.
+        """
+
+        tracklets = tracklets or {}
+        frame_ids = np.array(sorted(set(bboxes_dict) | set(tracklets)), dtype=np.int64)
+        counts = np.array([len(bboxes_dict.get(int(f), ())) for f in frame_ids], dtype=np.int64)
+        offsets = np.zeros(len(frame_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        chunks = [np.asarray(bboxes_dict[int(f)], dtype=np.float64) for f in frame_ids if int(f) in bboxes_dict]
+        bboxes = np.concatenate(chunks) if chunks else np.empty((0, len(BBOX_COLUMNS)))
+
+        keypoints = None
+        if keypoints_dict:
+            num_keypoints = next(iter(keypoints_dict.values())).shape[1]
+            keypoints = np.full((len(bboxes), num_keypoints, 3), np.nan)
+            for idx, f in enumerate(frame_ids):
+                if int(f) in keypoints_dict:
+                    keypoints[offsets[idx] : offsets[idx + 1]] = keypoints_dict[int(f)]
+        return cls(frame_ids, offsets, bboxes, tracklets, keypoints=keypoints, schema_id=schema_id)
+
+    @classmethod
+    def from_frames(cls, frames: Sequence[FrameAnnotation]) -> "FrameStore":
+        """
+        Convert an eagerly materialized list of `FrameAnnotation` into a store.
+        """
+
+        return cls.from_records([frame.model_dump() for frame in frames])
+
+    @classmethod
+    def from_records(cls, frames: List[dict]) -> "FrameStore":
+        """
+        Build a store straight from the raw `frames` list of an annotation JSON,
+        skipping pydantic validation of every bbox. Tracklets are kept as raw dicts
+        and validated when their frame is accessed.
+        """
+
+        # a store holds a single keypoint layout, named by the first keypoints found
+        schema_id = next(
+            (bbox["keypoints"].get("schema_id", COCO_WHOLEBODY.schema_id)
+             for frame in frames for bbox in frame.get("bbox") or [] if bbox.get("keypoints")),
+            COCO_WHOLEBODY.schema_id,
+        )
+        bboxes_dict, keypoints_dict = {}, {}
+        for frame in frames:
+            bboxes = frame.get("bbox") or []
+            bboxes_dict[frame["frame_id"]] = np.array(
+                [[bbox[col] for col in BBOX_COLUMNS] for bbox in bboxes], dtype=np.float64
+            ).reshape(-1, len(BBOX_COLUMNS))
+            if any(bbox.get("keypoints") for bbox in bboxes):
+                keypoints_dict[frame["frame_id"]] = np.stack(
+                    [_keypoints_row(bbox.get("keypoints"), schema_id) for bbox in bboxes]
+                )
+        tracklets = {frame["frame_id"]: frame.get("tracklet") for frame in frames}
+        return cls.from_columns(bboxes_dict, tracklets, keypoints_dict, schema_id)
+
+    def __len__(self) -> int:
+        return len(self.frame_ids)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            assert step == 1, "FrameStore only supports contiguous slices"
+            return self._take(start, stop, 0)
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("FrameStore index out of range")
+        return self._build_frame(idx)
+
+    def frame_arrays(self, idx: int):
+        """
+        Bbox rows and keypoints (or `None`) of the frame at position `idx`, as array
+        views, for vectorized consumers that never need `FrameAnnotation` objects.
+        """
+
+        lo, hi = self.bbox_offsets[idx], self.bbox_offsets[idx + 1]
+        keypoints = None if self.keypoints is None else self.keypoints[lo:hi]
+        return self.bboxes[lo:hi], keypoints
+
+    def __iter__(self) -> Iterator[FrameAnnotation]:
+        for idx in range(len(self)):
+            yield self._build_frame(idx)
+
+    def __contains__(self, frame) -> bool:
+        if isinstance(frame, FrameAnnotation):
+            return self.index_of(frame.frame_id) is not None
+        return False
+
+    def index_of(self, frame_id: int) -> Optional[int]:
+        """
+        Position of `frame_id` in this store, or `None` if the frame has no annotations.
+        """
+
+        idx = int(np.searchsorted(self.frame_ids, frame_id))
+        if idx < len(self.frame_ids) and self.frame_ids[idx] == frame_id:
+            return idx
+        return None
+
+    def get(self, frame_id: int, default: Optional[FrameAnnotation] = None) -> Optional[FrameAnnotation]:
+        """
+        Look up a frame by its true `frame_id` rather than its list position.
+        """
+
+        idx = self.index_of(frame_id)
+        return default if idx is None else self._build_frame(idx)
+
+    def window(self, start_frame: int, end_frame: int, rebase: bool = False) -> "FrameStore":
+        """
+        Frames with `start_frame <= frame_id < end_frame`. With `rebase`, frame ids,
+        bbox frame numbers and tracklet frame numbers are shifted so the window starts at 0.
+        Bbox arrays are shared with this store unless a rebase is required.
+        """
+
+        lo, hi = np.searchsorted(self.frame_ids, [start_frame, end_frame])
+        return self._take(int(lo), int(hi), start_frame if rebase else 0)
+
+    def select(self, ranges: Sequence[Tuple[int, int]]) -> "FrameStore":
+        """
+        Frames inside any of the sorted, disjoint `[start, end)` frame `ranges`.
+        Bbox and keypoint arrays are copied, so the result can be modified on its own.
+        """
+
+        bounds = np.searchsorted(self.frame_ids, np.asarray(ranges, dtype=np.int64).reshape(-1, 2))
+        frame_idx = np.concatenate([np.arange(lo, hi) for lo, hi in bounds] + [np.empty(0, dtype=np.int64)])
+        rows = np.concatenate(
+            [np.arange(self.bbox_offsets[lo], self.bbox_offsets[hi]) for lo, hi in bounds] + [np.empty(0, dtype=np.int64)]
+        )
+        offsets = np.zeros(len(frame_idx) + 1, dtype=np.int64)
+        np.cumsum(np.diff(self.bbox_offsets)[frame_idx], out=offsets[1:])
+        return FrameStore(
+            self.frame_ids[frame_idx],
+            offsets,
+            self.bboxes[rows],
+            self.tracklets,
+            self.tracklet_offset,
+            keypoints=None if self.keypoints is None else self.keypoints[rows],
+            schema_id=self.schema_id,
+        )
+
+    def _take(self, lo: int, hi: int, shift: int) -> "FrameStore":
+        b_lo, b_hi = self.bbox_offsets[lo], self.bbox_offsets[hi]
+        bboxes = self.bboxes[b_lo:b_hi]
+        if shift:
+            bboxes = bboxes.copy()
+            bboxes[:, 0] -= shift
+        return FrameStore(
+            self.frame_ids[lo:hi] - shift,
+            self.bbox_offsets[lo : hi + 1] - b_lo,
+            bboxes,
+            self.tracklets,
+            self.tracklet_offset + shift,
+            keypoints=None if self.keypoints is None else self.keypoints[b_lo:b_hi],
+            schema_id=self.schema_id,
+        )
+
+    def _build_frame(self, idx: int) -> FrameAnnotation:
+        frame_id = int(self.frame_ids[idx])
+        rows, keypoints = self.frame_arrays(idx)
+        bboxes = [
+            Bbox(
+                frame_number=int(row[0]),
+                player_id=int(row[1]),
+                x=row[2],
+                y=row[3],
+                width=row[4],
+                height=row[5],
+                confidence=row[6],
+                keypoints=(
+                    Keypoints(schema_id=self.schema_id, keypoints=keypoints[i].tolist())
+                    if keypoints is not None and not np.isnan(keypoints[i]).all()
+                    else None
+                ),
+            )
+            for i, row in enumerate(rows.tolist())
+        ]
+
+        return FrameAnnotation(frame_id=frame_id, bbox=bboxes, tracklet=self.tracklet_at(idx))
+
+    def tracklet_at(self, idx: int) -> Optional[Tracklet]:
+        """
+        Tracklet of the frame at position `idx`, without building its bboxes.
+        """
+
+        tracklet = self.tracklets.get(int(self.frame_ids[idx]) + self.tracklet_offset)
+        if isinstance(tracklet, dict):
+            tracklet = Tracklet(**tracklet)
+        if tracklet is not None and self.tracklet_offset:
+            tracklet = tracklet.model_copy(update={"frame_number": tracklet.frame_number - self.tracklet_offset})
+        return tracklet
+
+
 class VideoAnnotation(BaseModel):
     """
     All annotations for a single video.
     Optionaly include a video `caption` and `action`.
+    `frames` is either a plain list (small objects, e.g. clips) or a lazy `FrameStore`
+    (full quarters); both serialize to the same JSON.
+    Clips that record their source replay (`is_virtual`) can be read without their own
+    MP4 through `virtual_clips`.
     """
 
+    # frames are serialized as plain dicts, so NaN keypoints need the setting here too
+    model_config = ConfigDict(arbitrary_types_allowed=True, ser_json_inf_nan="constants")
+
     video_id: int
     video_path: str
-    frames: List[FrameAnnotation]
+    frames: Union[FrameStore, List[FrameAnnotation]]
     caption: Optional[str] = None
     action: Optional[ActionAnnotation] = None
+    # clips record where they come from: frames [start_frame, end_frame) of the full-quarter
+    # replay `source_path`, so a virtual clip can be read without its own MP4
+    source_path: Optional[str] = None
+    start_frame: Optional[int] = None
+    end_frame: Optional[int] = None
+
+    @field_serializer("frames")
+    def serialize_frames(self, frames):
+        return [frame.model_dump() for frame in frames]
+
+    @property
+    def is_virtual(self) -> bool:
+        return self.source_path is not None and self.start_frame is not None and self.end_frame is not None
+
+    def frame(self, frame_id: int) -> Optional[FrameAnnotation]:
+        """
+        Look up a frame by its true `frame_id`. List positions only match frame ids
+        when every frame carries annotations, so don't index `frames` directly.
+        """
+
+        if isinstance(self.frames, FrameStore):
+            return self.frames.get(frame_id)
+        return next((frame for frame in self.frames if frame.frame_id == frame_id), None)
+
+    def frames_between(self, start_frame: int, end_frame: int) -> Sequence[FrameAnnotation]:
+        """
+        All frames with `start_frame <= frame_id < end_frame`.
+        """
+
+        if isinstance(self.frames, FrameStore):
+            return self.frames.window(start_frame, end_frame)
+        return [frame for frame in self.frames if start_frame <= frame.frame_id < end_frame]
+
+    def to_frame_store(self) -> "VideoAnnotation":
+        """
+        Return a copy of this annotation backed by a lazy `FrameStore`.
+        """
+
+        if isinstance(self.frames, FrameStore):
+            return self
+        return self.model_copy(update={"frames": FrameStore.from_frames(self.frames)})
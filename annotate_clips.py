@@ -1,65 +1,36 @@
 import os
 import json
-import pandas as pd
-import cv2
+import numpy as np
 
 from glob import glob
-from typing import List
-from pydantic import BaseModel
-from annot_types import VideoAnnotation, FrameAnnotation, ActionAnnotation, ActionName
-from datetime import timedelta
-
-# global fps value for all videos in our dataset
-FPS = 30.0
-
-# all column names for HUDL logs
-columns = [
-    "id",
-    "action_id",
-    "action_name",
-    "player_id",
-    "player_name",
-    "team_id",
-    "team_name",
-    "opponent_id",
-    "opponent_name",
-    "opponent_team_id",
-    "opponent_team_name",
-    "teammate_id",
-    "teammate_name",
-    "half",
-    "second",
-    "pos_x",
-    "pos_y",
-    "possession_id",
-    "possession_name",
-    "possession_team_id",
-    "possession_team_name",
-    "possession_number",
-    "possession_start_clear",
-    "possession_end_clear",
-    "playtype",
-    "hand",
-    "shot_type",
-    "drive",
-    "dribble_move",
-    "contesting",
-    "ts",
-]
-
-
-def load_video_annotation(file_path: str) -> VideoAnnotation:
+from typing import List, Optional
+from annot_types import VideoAnnotation, FrameStore
+from annotation_io import AnnotationWriter, save_annotation
+from pose_scheduler import PoseEstimator, annotate_clip_poses
+from profiling import timed, count, enable_run_log, write_summary
+from hudl_logs import load_game_log, clip_events, action_annotations_from_df, IGNORED_ACTIONS, HUDL_CACHE_DIR
+from frame_timing import FrameClock, PROBE_CACHE_DIR
+from chunking import ChunkedQuarter, assign_chunks
+
+
+@timed("load_video_annotation")
+def load_video_annotation(file_path: str, lazy: bool = False) -> VideoAnnotation:
     """
     Load an annotation file as found in the `annotations` dir.
+    With `lazy`, frames are kept in a columnar `FrameStore` and only built on access.
     """
     
     assert os.path.isfile(file_path), f"{file_path} does not exist"
     try:
         with open(file_path, "r") as f:
             data = json.load(f)
+        count("bytes_read", os.path.getsize(file_path))
     except Exception as e:
         raise Exception(f"Failed to load annotation from {file_path}: {e}")
     
+    if lazy:
+        data["frames"] = FrameStore.from_records(data["frames"])
+
     # im such a noob, **data is meta
     return VideoAnnotation(**data)
 
@@ -69,14 +40,16 @@ def save_video_annotation(annotation: VideoAnnotation, file_path: str):
     Save video annotation object to `file_path`.
     """
     
-    assert os.path.exists(file_path), f"{file_path} does not exist"
+    output_dir = os.path.dirname(file_path) or "."
+    assert os.path.isdir(output_dir), f"{output_dir} does not exist"
     try:
-        with open(file_path, "w") as f:
-            json.dump(annotation.dict(), f, indent=4)
+        # written to a temp file and renamed, a crash never leaves a truncated file
+        save_annotation(annotation, file_path)
     except Exception as e:
         raise Exception(f"Failed to save annotation to {file_path}: {e}")
 
 
+@timed("split_video_annotation")
 def split_video_annotation(
     video_annotation: VideoAnnotation, clip_info: dict, video_path: str
 ) -> VideoAnnotation:
@@ -84,31 +57,32 @@ def split_video_annotation(
     Clip a video and return a new `VideoAnnotation` object.
     """
     
-    # get start and end frames of a clip
-    start_time = clip_info["start_time"]
-    duration = clip_info["duration"]
+    # start and end frames of the clip, aligned to the replay's timestamps by `FrameClock`
+    start_frame = clip_info["start_frame"]
+    end_frame = clip_info["end_frame"]
 
-    start_frame = int((start_time - duration) * FPS)
-    end_frame = int(start_time * FPS)
+    if isinstance(video_annotation.frames, FrameStore):
+        # only frames inside the clip are ever materialized
+        clip_frames = list(video_annotation.frames.window(start_frame, end_frame, rebase=True))
+    else:
+        clip_frames = []
+        for frame in video_annotation.frames:
 
-    clip_frames = []
-    for frame in video_annotation.frames:
-        
-        # what is this frame_id attribute?
-        if start_frame <= frame.frame_id < end_frame:
-            new_frame = frame.model_copy(deep=True)
-            new_frame.frame_id -= start_frame
+            # what is this frame_id attribute?
+            if start_frame <= frame.frame_id < end_frame:
+                new_frame = frame.model_copy(deep=True)
+                new_frame.frame_id -= start_frame
 
-            # adjust bbox frame numbers
-            if new_frame.bbox:
-                for bbox in new_frame.bbox:
-                    bbox.frame_number -= start_frame
+                # adjust bbox frame numbers
+                if new_frame.bbox:
+                    for bbox in new_frame.bbox:
+                        bbox.frame_number -= start_frame
 
-            # adjust tracklet frame number if it exists
-            if new_frame.tracklet:
-                new_frame.tracklet.frame_number -= start_frame
+                # adjust tracklet frame number if it exists
+                if new_frame.tracklet:
+                    new_frame.tracklet.frame_number -= start_frame
 
-            clip_frames.append(new_frame)
+                clip_frames.append(new_frame)
 
     # Save start and end frames as JPEGs
     # video = cv2.VideoCapture(os.path.join('game-replays',video_path))
@@ -130,173 +104,130 @@ def split_video_annotation(
         video_path=clip_info["output_path"],
         frames=clip_frames,
         caption=f"{clip_info['action_name']} by {clip_info['player_name']}",
+        source_path=video_path,
+        start_frame=start_frame,
+        end_frame=end_frame,
     )
 
 
 def process_annotations(
-    video_path: str, log_path: str, annotation_path: str, output_path: str
+    video_path: str,
+    log_path: str,
+    annotation_path: str,
+    output_path: str,
+    pose_estimator: Optional[PoseEstimator] = None,
 ):
     """
-    
+    Write clip annotations for every quarter in `video_path`.
+    With a `pose_estimator`, keypoints are estimated for all frames covered by clips.
     """
     
-    ignore = [
-        "Start of the offensive possession",
-        "Shooting guard",
-        "Guard",
-        "Center",
-        "Power forward",
-        "Forward",
-        "Timeout",
-        "Halftime",
-        "2nd quarter",
-        "Starting lineup",
-        "3rd quarter",
-        "1st quarter",
-        "4th quarter",
-        "Match end",
-        "Game stop",
-        "Ball in play",
-        "Error leading to goal",
-        "Accurate pass",
-    ]
+    ignore = IGNORED_ACTIONS
 
-    
     video_file_names = [os.path.basename(f) for f in glob(f"{video_path}/*.mp4")]
-    for video_file in video_file_names:
-
-        game_id = int(video_file.split("_")[0])
-        period_id = video_file.split("_")[6].split(".")[0]
-
-        # Load the corresponding log file
-        log_file = next(
-            (log for log in os.listdir(log_path) if str(game_id) in log), None
-        )
-        if log_file is None:
-            continue
+    with AnnotationWriter() as writer:
+        for video_file in video_file_names:
+            process_video_annotations(
+                video_path, video_file, log_path, annotation_path, output_path, ignore, writer, pose_estimator
+            )
+
+
+def process_video_annotations(
+    video_path: str,
+    video_file: str,
+    log_path: str,
+    annotation_path: str,
+    output_path: str,
+    ignore: List[str],
+    writer: AnnotationWriter,
+    pose_estimator: Optional[PoseEstimator] = None,
+    hudl_cache_dir: Optional[str] = HUDL_CACHE_DIR,
+    probe_cache_dir: Optional[str] = PROBE_CACHE_DIR,
+):
+    """
+    Write the clip annotations of every event in a single quarter.
+    Quarters written in chunks (see `chunking`) are processed one chunk at a time.
+    """
 
-        log_df = pd.read_csv(
-            os.path.join(log_path, log_file),
-            skiprows=1,
-            delimiter=";",
-            header=None,
-            names=columns,
-        )
-
-        # load the corresponding annotation file
-        annotation_file = f"{game_id}_{period_id}_video_annotation.json"
-        annotation_path_full = os.path.join(annotation_path, annotation_file)
-        assert os.path.exists(annotation_path_full), f"{annotation_path_full} does not exist"
-        
-        if not os.path.exists(annotation_path_full):
+    game_id = int(video_file.split("_")[0])
+    period_id = video_file.split("_")[6].split(".")[0]
+
+    # Load the corresponding log file, parsed once per game
+    log_df = load_game_log(log_path, game_id, hudl_cache_dir)
+    if log_df is None:
+        return
+
+    # load the corresponding annotation file
+    annotation_file = f"{game_id}_{period_id}_video_annotation.json"
+    annotation_path_full = os.path.join(annotation_path, annotation_file)
+    chunked = not os.path.exists(annotation_path_full) and ChunkedQuarter.exists(annotation_path_full)
+    assert os.path.exists(annotation_path_full) or chunked, f"{annotation_path_full} does not exist"
+
+    period = int(video_file[-5])
+    events = clip_events(log_df, period, ignore)
+    count("events", len(events))
+    action_annotations = action_annotations_from_df(events)
+
+    # frame timestamps are probed once per replay and cached, every clip is mapped in one pass
+    clock = FrameClock.from_video(os.path.join(video_path, video_file), probe_cache_dir)
+    windows = clock.clip_windows(events)
+
+    output_folder = os.path.join(output_path, str(game_id), str(period_id))
+    os.makedirs(output_folder, exist_ok=True)
+
+    def write_clips(video_annotation: VideoAnnotation, selected: np.ndarray):
+        clip_events_ = events.iloc[selected]
+        if pose_estimator is not None:
+            # one pass over the union of the clip windows, see `pose_scheduler`
+            video_annotation = annotate_clip_poses(
+                os.path.join(video_path, video_file), video_annotation, clip_events_, pose_estimator, clock
+            )
+
+        for event, i in zip(
+            clip_events_[["id", "action_name", "player_name", "start_time", "duration"]].itertuples(index=False),
+            selected.tolist(),
+        ):
+            start_frame, end_frame = windows[i].tolist()
+            clip_info = {
+                "start_time": event.start_time,
+                "duration": event.duration,
+                "start_frame": start_frame,
+                "end_frame": end_frame,
+                "action_id": event.id,
+                "action_name": event.action_name,
+                "player_name": event.player_name,
+                "output_path": f"{game_id}_{period_id}_{event.action_name}_{event.id}.mp4",
+            }
+
+            clip_annotation = split_video_annotation(
+                video_annotation, clip_info, video_file
+            )
+
+            # Add ActionAnnotation to the clip annotation
+            clip_annotation.action = action_annotations[i]
+
+            # Save the clip annotation
+            output_file = os.path.join(
+                output_folder,
+                f"{clip_info['output_path'].replace('.mp4', '_annotation.json')}",
+            )
+            writer.submit(clip_annotation, output_file)
+
+    if not chunked:
+        write_clips(load_video_annotation(annotation_path_full, lazy=True), np.arange(len(events)))
+        return
+
+    # clips are grouped by the chunk containing them, so only one chunk is held at a time
+    quarter = ChunkedQuarter(annotation_path_full)
+    chunk_ids = assign_chunks(windows, quarter.chunks)
+    for chunk in np.unique(chunk_ids).tolist():
+        selected = np.flatnonzero(chunk_ids == chunk)
+        if chunk >= 0:
+            write_clips(quarter.load(chunk), selected)
             continue
-
-        video_annotation = load_video_annotation(annotation_path_full)
-        extend_time = 3.5
-        period = int(video_file[-5])
-        for _, row in log_df.iterrows():
-            if int(row["half"]) != period:
-                continue
-
-            if (
-                row["action_name"] not in ignore
-                and not pd.isna(row["second"])
-                and not pd.isna(row["player_name"])
-            ):
-
-                duration = 10
-
-                if row["action_name"] == "Assisting":
-                    if pd.isna(row["teammate_id"]):
-                        continue
-                    player_id = int(row["teammate_id"])
-                    player_name = row["teammate_name"]
-                elif "1" in row["action_name"]:
-                    extend_time = 4.5
-                    player_id = int(row["player_id"])
-                    player_name = row["player_name"]
-                elif row["action_name"] == "Turnover":
-                    extend_time = 2.5
-                    player_id = int(row["player_id"])
-                    player_name = row["player_name"]
-                else:
-                    player_id = int(row["player_id"])
-                    player_name = row["player_name"]
-
-                start_time = float(row["second"]) + extend_time
-
-                clip_info = {
-                    "start_time": start_time,
-                    "duration": duration,
-                    "action_id": row["id"],
-                    "action_name": row["action_name"],
-                    "player_name": player_name,
-                    "output_path": f"{game_id}_{period_id}_{row['action_name']}_{row['id']}.mp4",
-                }
-
-                clip_annotation = split_video_annotation(
-                    video_annotation, clip_info, video_file
-                )
-
-                pos_x = row["pos_x"] if not pd.isna(row["pos_x"]) else None
-                pos_y = row["pos_y"] if not pd.isna(row["pos_y"]) else None
-
-                # Helper function to convert to int or None
-                def to_int_or_none(value):
-                    return int(value) if pd.notna(value) and value != "" else None
-
-                # Create ActionAnnotation
-                action_annotation = ActionAnnotation(
-                    id=to_int_or_none(row["id"]),
-                    action_id=(
-                        str(row["action_id"]) if pd.notna(row["action_id"]) else None
-                    ),
-                    action_name=row["action_name"],
-                    player_id=str(player_id),
-                    player_name=player_name,
-                    team_id=to_int_or_none(row["team_id"]),
-                    team_name=row["team_name"],
-                    opponent_id=to_int_or_none(row["opponent_id"]),
-                    opponent_name=row["opponent_name"],
-                    opponent_team_id=to_int_or_none(row["opponent_team_id"]),
-                    opponent_team_name=row["opponent_team_name"],
-                    teammate_id=(
-                        str(row["teammate_id"])
-                        if pd.notna(row["teammate_id"])
-                        else None
-                    ),
-                    teammate_name=row["teammate_name"],
-                    half=to_int_or_none(row["half"]),
-                    second=float(row["second"]) if pd.notna(row["second"]) else None,
-                    pos_x=pos_x,
-                    pos_y=pos_y,
-                    possession_id=to_int_or_none(row["possession_id"]),
-                    possession_name=row["possession_name"],
-                    possession_team_id=to_int_or_none(row["possession_team_id"]),
-                    possession_team_name=row["possession_team_name"],
-                    possession_number=to_int_or_none(row["possession_number"]),
-                    possession_start_clear=row["possession_start_clear"],
-                    possession_end_clear=row["possession_end_clear"],
-                    playtype=row["playtype"],
-                    hand=row["hand"],
-                    shot_type=row["shot_type"],
-                    drive=row["drive"],
-                    dribble_move=row["dribble_move"],
-                    contesting=row["contesting"],
-                    ts=row["ts"],
-                )
-
-                # Add ActionAnnotation to the clip annotation
-                clip_annotation.action = action_annotation
-
-                # Save the clip annotation
-                output_folder = os.path.join(output_path, str(game_id), str(period_id))
-                os.makedirs(output_folder, exist_ok=True)
-                output_file = os.path.join(
-                    output_folder,
-                    f"{clip_info['output_path'].replace('.mp4', '_annotation.json')}",
-                )
-                save_video_annotation(clip_annotation, output_file)
+        # clips longer than the chunk overlap are assembled from adjacent chunks one by one
+        for i in selected:
+            write_clips(quarter.window(*windows[i].tolist()), np.array([i]))
 
 
 if __name__ == "__main__":
@@ -305,4 +236,6 @@ if __name__ == "__main__":
     annotation_path = "./annotations"
     output_path = "./clip-annotations"
 
+    enable_run_log()
     process_annotations(video_path, log_path, annotation_path, output_path)
+    write_summary()
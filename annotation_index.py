@@ -0,0 +1,370 @@
+"""
+Query index over the `clip-annotations` corpus, so questions like "all made threes from
+the left wing" or "every frame where player X is within 5 ft of the ball" don't need to
+open every clip annotation.
+
+The index holds two columnar tables:
+- events: one row per clip with the fields of its `ActionAnnotation`
+- positions: one row per StatVU `Position` per annotated clip frame, with the distance to
+  the ball in the same moment precomputed
+Positions are sorted by player, so player queries are a slice, and bucketed into a
+uniform grid over the court, so region queries only look at the cells they overlap.
+Queries return `Match(clip, start_frame, end_frame)` with clip-relative `[start, end)` frames.
+
+    python annotation_index.py  # indexes ./clip-annotations into ./annotation-index.npz
+"""
+
+import io
+import os
+import json
+from glob import glob
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from annot_types import VideoAnnotation, Tracklet
+from annotation_io import BINARY_EXT, JSON_EXT, load_annotation, write_atomic
+from profiling import timed, count
+
+INDEX_FILE = "./annotation-index.npz"
+
+# side of a grid cell, in StatVU court units (feet)
+GRID_CELL_SIZE = 5.0
+
+# StatVU rows of the ball use -1 as `team_id` / `player_id`
+BALL_ID = -1
+
+# integer `ActionAnnotation` fields, missing values are stored as -1
+EVENT_INT_FIELDS = ("id", "team_id", "opponent_team_id", "half", "possession_id", "possession_team_id")
+# float `ActionAnnotation` fields, missing values are stored as NaN
+EVENT_FLOAT_FIELDS = ("second", "pos_x", "pos_y")
+# string `ActionAnnotation` fields, stored as codes into a vocabulary
+EVENT_STR_FIELDS = ("action_name", "player_id", "shot_type")
+
+
+class Match(NamedTuple):
+    """
+    Frames `[start_frame, end_frame)` of the clip whose annotation is at `clip`.
+    """
+
+    clip: str
+    start_frame: int
+    end_frame: int
+
+
+def find_clip_annotations(annotations_dir: str) -> List[str]:
+    """
+    Every clip annotation under `clip-annotations/<game>/<period>`, JSON or binary.
+    """
+
+    paths = []
+    for ext in (JSON_EXT, BINARY_EXT):
+        paths += glob(os.path.join(annotations_dir, "*", "*", f"*_annotation{ext}"))
+    return sorted(paths)
+
+
+def _moment_positions(tracklet) -> list:
+    # tracklets of a lazily loaded store are raw dicts until validated
+    if tracklet is None:
+        return []
+    if isinstance(tracklet, Tracklet):
+        return [position.model_dump() for position in tracklet.moment.player_positions]
+    return (tracklet.get("moment") or {}).get("player_positions") or []
+
+
+def _clip_positions(annotation: VideoAnnotation) -> np.ndarray:
+    """
+    (n, 6) array of `frame, team_id, player_id, x, y, ball_dist` for every position
+    of every frame of the clip.
+    """
+
+    store = annotation.to_frame_store().frames
+    rows = []
+    for idx, frame_id in enumerate(store.frame_ids):
+        tracklet = store.tracklets.get(int(frame_id) + store.tracklet_offset)
+        positions = _moment_positions(tracklet)
+        if not positions:
+            continue
+        frame = np.array(
+            [[frame_id, p["team_id"], p["player_id"], p["x_position"], p["y_position"]] for p in positions],
+            dtype=np.float64,
+        )
+        ball = frame[frame[:, 2] == BALL_ID]
+        if len(ball):
+            ball_dist = np.hypot(frame[:, 3] - ball[0, 3], frame[:, 4] - ball[0, 4])
+        else:
+            ball_dist = np.full(len(frame), np.nan)
+        rows.append(np.column_stack([frame, ball_dist]))
+    return np.concatenate(rows) if rows else np.empty((0, 6))
+
+
+def _clip_length(annotation: VideoAnnotation) -> int:
+    if annotation.start_frame is not None and annotation.end_frame is not None:
+        return max(annotation.end_frame - annotation.start_frame, 0)
+    return int(annotation.to_frame_store().frames.frame_ids.max(initial=-1)) + 1
+
+
+def _encode(values: Sequence[Optional[str]]) -> Tuple[np.ndarray, List[str]]:
+    # -1 marks a missing value
+    vocab = sorted({value for value in values if value is not None})
+    lookup = {value: code for code, value in enumerate(vocab)}
+    return np.array([lookup.get(value, -1) for value in values], dtype=np.int32), vocab
+
+
+def _runs(clips: np.ndarray, frames: np.ndarray) -> List[Tuple[int, int, int]]:
+    """
+    Collapse `(clip, frame)` pairs into `(clip, start, end)` runs of consecutive frames.
+    """
+
+    if len(clips) == 0:
+        return []
+    order = np.lexsort((frames, clips))
+    clips, frames = clips[order], frames[order]
+    keep = np.r_[True, (np.diff(clips) != 0) | (np.diff(frames) != 0)]
+    clips, frames = clips[keep], frames[keep]
+
+    breaks = np.flatnonzero((np.diff(clips) != 0) | (np.diff(frames) > 1)) + 1
+    starts = np.r_[0, breaks]
+    ends = np.r_[breaks, len(clips)] - 1
+    return list(zip(clips[starts].tolist(), frames[starts].tolist(), (frames[ends] + 1).tolist()))
+
+
+class AnnotationIndex:
+    """
+    In-memory index over a set of clip annotations, see the module docstring.
+    Build it with `build`, persist it with `save` / `load`.
+    """
+
+    def __init__(
+        self,
+        clips: List[str],
+        clip_lengths: np.ndarray,
+        events: Dict[str, np.ndarray],
+        positions: Dict[str, np.ndarray],
+        vocab: Dict[str, List[str]],
+        cell_size: float = GRID_CELL_SIZE,
+    ):
+        self.clips = list(clips)
+        self.clip_lengths = np.asarray(clip_lengths, dtype=np.int64)
+        self.events = events
+        self.vocab = vocab
+        self.cell_size = float(cell_size)
+
+        # positions sorted by player, `player_offsets[i]:player_offsets[i + 1]` are the rows of `players[i]`
+        order = np.lexsort((positions["frame"], positions["clip"], positions["player_id"]))
+        self.positions = {name: column[order] for name, column in positions.items()}
+        self.players, starts = np.unique(self.positions["player_id"], return_index=True)
+        self.player_offsets = np.r_[starts, len(order)].astype(np.int64)
+
+        # uniform grid, `grid_order[grid_offsets[c]:grid_offsets[c + 1]]` are the rows in cell `c`
+        x, y = self.positions["x"], self.positions["y"]
+        self.origin = (float(x.min()), float(y.min())) if len(x) else (0.0, 0.0)
+        self.grid_shape = (
+            int((x.max() - self.origin[0]) // self.cell_size) + 1 if len(x) else 1,
+            int((y.max() - self.origin[1]) // self.cell_size) + 1 if len(y) else 1,
+        )
+        cells = self._cell(x, y)
+        self.grid_order = np.argsort(cells, kind="stable")
+        self.grid_offsets = np.searchsorted(
+            cells[self.grid_order], np.arange(self.grid_shape[0] * self.grid_shape[1] + 1)
+        ).astype(np.int64)
+
+    def __len__(self) -> int:
+        return len(self.clips)
+
+    @classmethod
+    @timed("index_build")
+    def build(cls, annotations_dir: str, cell_size: float = GRID_CELL_SIZE) -> "AnnotationIndex":
+        """
+        Index every clip annotation under `annotations_dir`.
+        """
+
+        clips, clip_lengths, actions, positions = [], [], [], []
+        for path in find_clip_annotations(annotations_dir):
+            ext = os.path.splitext(path)[1]
+            with open(path, "rb") as f:
+                data = f.read()
+            count("bytes_read", len(data))
+            try:
+                annotation = load_annotation(data, ext, lazy=True)
+            except Exception as e:
+                print(f"Warning: failed to load {path}: {e}. Skipping.")
+                continue
+
+            clip = len(clips)
+            clips.append(os.path.relpath(path, annotations_dir))
+            clip_lengths.append(_clip_length(annotation))
+            actions.append(annotation.action.model_dump() if annotation.action else {})
+            clip_positions = _clip_positions(annotation)
+            positions.append(np.column_stack([np.full(len(clip_positions), clip), clip_positions]))
+        count("clips_indexed", len(clips))
+
+        events = {"clip": np.arange(len(clips), dtype=np.int32)}
+        vocab = {}
+        for name in EVENT_INT_FIELDS:
+            events[name] = np.array([action.get(name) if action.get(name) is not None else -1 for action in actions], dtype=np.int64)
+        for name in EVENT_FLOAT_FIELDS:
+            events[name] = np.array([action.get(name) if action.get(name) is not None else np.nan for action in actions], dtype=np.float64)
+        for name in EVENT_STR_FIELDS:
+            events[name], vocab[name] = _encode([action.get(name) for action in actions])
+
+        rows = np.concatenate(positions) if positions else np.empty((0, 7))
+        columns = {
+            "clip": rows[:, 0].astype(np.int32),
+            "frame": rows[:, 1].astype(np.int64),
+            "team_id": rows[:, 2].astype(np.int64),
+            "player_id": rows[:, 3].astype(np.int64),
+            "x": rows[:, 4],
+            "y": rows[:, 5],
+            "ball_dist": rows[:, 6],
+        }
+        count("positions_indexed", len(rows))
+        return cls(clips, clip_lengths, events, columns, vocab, cell_size)
+
+    def save(self, file_path: str = INDEX_FILE):
+        header = {"clips": self.clips, "vocab": self.vocab, "cell_size": self.cell_size}
+        arrays = {
+            "header": np.frombuffer(json.dumps(header).encode("utf-8"), dtype=np.uint8),
+            "clip_lengths": self.clip_lengths,
+            **{f"event_{name}": column for name, column in self.events.items()},
+            **{f"position_{name}": column for name, column in self.positions.items()},
+        }
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        write_atomic(file_path, buffer.getvalue())
+
+    @classmethod
+    @timed("index_load")
+    def load(cls, file_path: str = INDEX_FILE) -> "AnnotationIndex":
+        with np.load(file_path) as archive:
+            header = json.loads(archive["header"].tobytes().decode("utf-8"))
+            events = {name[len("event_"):]: archive[name] for name in archive.files if name.startswith("event_")}
+            positions = {name[len("position_"):]: archive[name] for name in archive.files if name.startswith("position_")}
+            clip_lengths = archive["clip_lengths"]
+        return cls(header["clips"], clip_lengths, events, positions, header["vocab"], header["cell_size"])
+
+    def _code(self, field: str, value: str) -> int:
+        try:
+            return self.vocab[field].index(value)
+        except ValueError:
+            return -2  # matches nothing, not even missing values
+
+    def _cell(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        cx = np.clip(((x - self.origin[0]) // self.cell_size).astype(np.int64), 0, self.grid_shape[0] - 1)
+        cy = np.clip(((y - self.origin[1]) // self.cell_size).astype(np.int64), 0, self.grid_shape[1] - 1)
+        return cx * self.grid_shape[1] + cy
+
+    def _grid_rows(self, x0: float, y0: float, x1: float, y1: float) -> np.ndarray:
+        """
+        Position rows in the grid cells overlapping the box, a superset of the rows inside it.
+        """
+
+        (cx0, cx1), (cy0, cy1) = [
+            np.clip(((np.array(bounds) - origin) // self.cell_size).astype(np.int64), 0, size - 1)
+            for bounds, origin, size in zip(((x0, x1), (y0, y1)), self.origin, self.grid_shape)
+        ]
+        cells = (np.arange(cx0, cx1 + 1)[:, None] * self.grid_shape[1] + np.arange(cy0, cy1 + 1)[None, :]).ravel()
+        starts, ends = self.grid_offsets[cells], self.grid_offsets[cells + 1]
+        if not len(cells) or (ends - starts).sum() == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([self.grid_order[s:e] for s, e in zip(starts, ends)])
+
+    def find_events(
+        self,
+        action_name: Optional[str] = None,
+        player_id: Optional[str] = None,
+        team_id: Optional[int] = None,
+        possession_team_id: Optional[int] = None,
+        shot_type: Optional[str] = None,
+        region: Optional[Tuple[float, float, float, float]] = None,
+    ) -> List[Match]:
+        """
+        Clips whose action matches every given filter. `player_id` is the HUDL id and
+        `region` is an `(x0, y0, x1, y1)` box on the HUDL `pos_x` / `pos_y` of the action.
+        Each match spans its whole clip.
+        """
+
+        mask = np.ones(len(self.clips), dtype=bool)
+        if action_name is not None:
+            mask &= self.events["action_name"] == self._code("action_name", action_name)
+        if player_id is not None:
+            mask &= self.events["player_id"] == self._code("player_id", player_id)
+        if shot_type is not None:
+            mask &= self.events["shot_type"] == self._code("shot_type", shot_type)
+        if team_id is not None:
+            mask &= self.events["team_id"] == team_id
+        if possession_team_id is not None:
+            mask &= self.events["possession_team_id"] == possession_team_id
+        if region is not None:
+            x0, y0, x1, y1 = region
+            x, y = self.events["pos_x"], self.events["pos_y"]
+            mask &= (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+
+        return [Match(self.clips[clip], 0, int(self.clip_lengths[clip])) for clip in np.flatnonzero(mask)]
+
+    def find_frames(
+        self,
+        player_id: Optional[int] = None,
+        team_id: Optional[int] = None,
+        region: Optional[Tuple[float, float, float, float]] = None,
+        near: Optional[Tuple[float, float, float]] = None,
+        ball_within: Optional[float] = None,
+        clips: Optional[Sequence[Match]] = None,
+    ) -> List[Match]:
+        """
+        Runs of consecutive clip frames in which a StatVU position matches every given filter:
+        - `player_id` / `team_id`: StatVU ids (the ball is never matched unless asked for with `BALL_ID`)
+        - `region`: `(x0, y0, x1, y1)` box on the court
+        - `near`: `(x, y, radius)` circle on the court
+        - `ball_within`: at most this far from the ball
+        - `clips`: only frames of these clips, e.g. the result of `find_events`
+        """
+
+        if player_id is not None:
+            i = int(np.searchsorted(self.players, player_id))
+            found = i < len(self.players) and self.players[i] == player_id
+            rows = np.arange(self.player_offsets[i], self.player_offsets[i + 1]) if found else np.empty(0, dtype=np.int64)
+        else:
+            rows = None
+
+        boxes = []
+        if region is not None:
+            boxes.append(region)
+        if near is not None:
+            x, y, radius = near
+            boxes.append((x - radius, y - radius, x + radius, y + radius))
+        for box in boxes:
+            # the grid only narrows the candidates down, the exact filters run below
+            grid_rows = self._grid_rows(*box)
+            rows = grid_rows if rows is None else np.intersect1d(rows, grid_rows, assume_unique=True)
+
+        if rows is None:
+            rows = np.arange(len(self.positions["clip"]))
+        p = {name: column[rows] for name, column in self.positions.items()}
+
+        mask = np.ones(len(rows), dtype=bool)
+        if player_id is None:
+            mask &= p["player_id"] != BALL_ID
+        if team_id is not None:
+            mask &= p["team_id"] == team_id
+        if region is not None:
+            x0, y0, x1, y1 = region
+            mask &= (p["x"] >= x0) & (p["x"] <= x1) & (p["y"] >= y0) & (p["y"] <= y1)
+        if near is not None:
+            x, y, radius = near
+            mask &= np.hypot(p["x"] - x, p["y"] - y) <= radius
+        if ball_within is not None:
+            mask &= p["ball_dist"] <= ball_within
+        if clips is not None:
+            lookup = {path: clip for clip, path in enumerate(self.clips)}
+            mask &= np.isin(p["clip"], [lookup[match.clip] for match in clips if match.clip in lookup])
+
+        return [Match(self.clips[clip], start, end) for clip, start, end in _runs(p["clip"][mask], p["frame"][mask])]
+
+
+if __name__ == "__main__":
+    annotations_dir = "./clip-annotations"
+
+    index = AnnotationIndex.build(annotations_dir)
+    index.save(INDEX_FILE)
+    print(f"Indexed {len(index)} clips and {len(index.positions['clip'])} positions into {INDEX_FILE}")
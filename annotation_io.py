@@ -0,0 +1,186 @@
+"""
+Serialization of `VideoAnnotation` objects.
+Besides the JSON files found in `annotations` and `clip-annotations`, annotations can be
+stored in a compact binary form: an `.npz` archive holding the `FrameStore` columns plus
+a small JSON header for everything that is not per-bbox.
+"""
+
+import io
+import os
+import json
+import queue
+import threading
+from typing import List, Tuple, Union
+
+import numpy as np
+
+from annot_types import VideoAnnotation, FrameStore
+from profiling import timed, count
+from keypoint_schemas import COCO_WHOLEBODY
+
+BINARY_EXT = ".npz"
+JSON_EXT = ".json"
+
+
+def dump_annotation_json(annotation: VideoAnnotation) -> bytes:
+    # pydantic-core's serializer is far faster than `json.dump(..., indent=4)`
+    return annotation.model_dump_json().encode("utf-8")
+
+
+def load_annotation_json(data: Union[bytes, str], lazy: bool = False) -> VideoAnnotation:
+    data = json.loads(data)
+    if lazy:
+        data["frames"] = FrameStore.from_records(data["frames"])
+    return VideoAnnotation(**data)
+
+
+def dump_annotation_binary(annotation: VideoAnnotation) -> bytes:
+    """
+    Encode an annotation as an `.npz` archive. Bboxes and keypoints are stored as raw
+    arrays (keypoints as float32); tracklets and the remaining fields go into a JSON header.
+    """
+
+    store = annotation.to_frame_store().frames
+    header = annotation.model_dump(exclude={"frames"})
+    header["schema_id"] = store.schema_id
+    header["tracklets"] = {
+        str(int(frame_id)): tracklet.model_dump()
+        for idx, frame_id in enumerate(store.frame_ids)
+        if (tracklet := store.tracklet_at(idx)) is not None
+    }
+
+    arrays = {
+        "frame_ids": store.frame_ids,
+        "bbox_offsets": store.bbox_offsets,
+        "bboxes": store.bboxes,
+        "header": np.frombuffer(json.dumps(header).encode("utf-8"), dtype=np.uint8),
+    }
+    if store.keypoints is not None:
+        arrays["keypoints"] = store.keypoints.astype(np.float32)
+
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def load_annotation_binary(data: bytes) -> VideoAnnotation:
+    """
+    Decode an archive written by `dump_annotation_binary`. Frames come back as a lazy
+    `FrameStore`; tracklets stay raw dicts until their frame is accessed.
+    """
+
+    with np.load(io.BytesIO(data)) as archive:
+        header = json.loads(archive["header"].tobytes().decode("utf-8"))
+        tracklets = {int(frame_id): tracklet for frame_id, tracklet in header.pop("tracklets").items()}
+        schema_id = header.pop("schema_id", COCO_WHOLEBODY.schema_id)
+        store = FrameStore(
+            archive["frame_ids"],
+            archive["bbox_offsets"],
+            archive["bboxes"],
+            tracklets,
+            keypoints=archive["keypoints"] if "keypoints" in archive.files else None,
+            schema_id=schema_id,
+        )
+    return VideoAnnotation(frames=store, **header)
+
+
+def dump_annotation(annotation: VideoAnnotation, ext: str = JSON_EXT) -> bytes:
+    if ext == BINARY_EXT:
+        return dump_annotation_binary(annotation)
+    return dump_annotation_json(annotation)
+
+
+def load_annotation(data: bytes, ext: str = JSON_EXT, lazy: bool = False) -> VideoAnnotation:
+    if ext == BINARY_EXT:
+        return load_annotation_binary(data)
+    return load_annotation_json(data, lazy=lazy)
+
+
+def write_atomic(file_path: str, data: bytes):
+    """
+    Write `data` to a temp file next to `file_path` and rename it into place, so
+    `file_path` either does not exist or is complete.
+    """
+
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def save_annotation(annotation: VideoAnnotation, file_path: str):
+    """
+    Serialize and atomically write `annotation`; `.npz` paths use the binary format.
+    """
+
+    ext = os.path.splitext(file_path)[1]
+    with timed("serialize"):
+        data = dump_annotation(annotation, ext)
+    with timed("write"):
+        write_atomic(file_path, data)
+    count("bytes_written", len(data))
+
+
+class AnnotationWriter:
+    """
+    Write-behind output for annotations. `submit` hands an annotation to a bounded
+    queue and returns immediately; background threads serialize and atomically write it,
+    so the compute loop overlaps with I/O. `max_pending` bounds how many (possibly
+    full-quarter) annotations are held in memory. Failed writes are reported per file as
+    they happen. Use as a context manager, or call `close`, which waits for all writes
+    and raises if any of them failed.
+    """
+
+    def __init__(self, num_workers: int = 2, max_pending: int = 8):
+        self._queue: queue.Queue = queue.Queue(max_pending)
+        self._errors: List[Tuple[str, BaseException]] = []
+        self._lock = threading.Lock()
+        self._workers = [threading.Thread(target=self._run, daemon=True) for _ in range(num_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            annotation, file_path = item
+            try:
+                save_annotation(annotation, file_path)
+            except Exception as e:
+                print(f"Failed to save {file_path}: {e}")
+                with self._lock:
+                    self._errors.append((file_path, e))
+
+    def submit(self, annotation: VideoAnnotation, file_path: str):
+        """
+        Queue `annotation` to be written to `file_path`; blocks while the queue is full.
+        """
+
+        self._queue.put((annotation, file_path))
+
+    @property
+    def errors(self) -> List[Tuple[str, BaseException]]:
+        with self._lock:
+            return list(self._errors)
+
+    def close(self):
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+        if self._errors:
+            file_path, e = self._errors[0]
+            raise Exception(f"Failed to save {len(self._errors)} annotation(s), first {file_path}: {e}") from e
+
+    def __enter__(self) -> "AnnotationWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,244 @@
+"""
+Memory-bounded processing of full-quarter annotations. Instead of one quarter-sized
+`VideoAnnotation`, a quarter is built, stored and read back as fixed-size frame windows
+(chunks). Consecutive chunks overlap by at least one clip length, so every clip lies
+entirely inside one chunk and clip slicing never needs more than one chunk in memory.
+
+Chunks are written as binary annotations next to a manifest listing them:
+
+    annotations/<video_id>_<quarter>_video_annotation.chunks.json
+    annotations/<video_id>_<quarter>_video_annotation.<start>-<end>.npz
+
+The manifest is written last, so its presence means the quarter is complete. Quarters are
+also built one chunk at a time, from inputs streamed in frame order.
+"""
+
+import os
+import json
+from typing import Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from annot_types import VideoAnnotation, FrameStore, BBOX_COLUMNS
+from annotation_io import BINARY_EXT, load_annotation, save_annotation, write_atomic
+from frame_timing import DEFAULT_FPS
+from hudl_logs import CLIP_DURATION
+from keypoint_schemas import COCO_WHOLEBODY
+from profiling import timed, count
+
+# per-worker memory budget for a quarter, in bytes
+DEFAULT_MEMORY_LIMIT = 2 << 30
+
+# overlap between consecutive chunks, in frames; longer than any clip so each clip fits in a chunk
+DEFAULT_CHUNK_OVERLAP = int(1.5 * CLIP_DURATION * DEFAULT_FPS)
+
+# rough size of the Python objects behind one StatVU moment (11 positions as dicts)
+TRACKLET_BYTES = 8 << 10
+
+# a chunk is held a few times over while it is sliced, posed and serialized
+CHUNK_COPIES = 4
+
+MANIFEST_SUFFIX = ".chunks.json"
+
+
+def frame_bytes(bboxes_per_frame: int = 10, num_keypoints: Optional[int] = None) -> int:
+    """
+    Estimated memory held by one annotated frame: bbox rows, keypoints and the tracklet.
+    Quarters are built without poses, pass `num_keypoints` only for chunks that hold them.
+    """
+
+    bbox_bytes = len(BBOX_COLUMNS) * 8
+    keypoint_bytes = (num_keypoints or 0) * 3 * 8
+    return bboxes_per_frame * (bbox_bytes + keypoint_bytes) + TRACKLET_BYTES
+
+
+def chunk_frames_for(memory_limit: int = DEFAULT_MEMORY_LIMIT, overlap: int = DEFAULT_CHUNK_OVERLAP, **frame_kwargs) -> int:
+    """
+    Largest chunk, in frames, that stays within `memory_limit`. Chunks are always at least
+    twice the overlap, otherwise they would mostly repeat each other.
+    """
+
+    chunk_frames = memory_limit // (CHUNK_COPIES * frame_bytes(**frame_kwargs))
+    return int(max(chunk_frames, 2 * overlap))
+
+
+def frame_chunks(first_frame: int, last_frame: int, chunk_frames: int, overlap: int = DEFAULT_CHUNK_OVERLAP) -> List[Tuple[int, int]]:
+    """
+    `[start, end)` windows of `chunk_frames` frames covering `[first_frame, last_frame)`,
+    each starting `chunk_frames - overlap` frames after the previous one.
+    """
+
+    assert chunk_frames > overlap, f"chunk_frames ({chunk_frames}) must be larger than overlap ({overlap})"
+    if last_frame <= first_frame:
+        return []
+    starts = np.arange(first_frame, max(last_frame - overlap, first_frame + 1), chunk_frames - overlap)
+    return [(int(start), int(min(start + chunk_frames, last_frame))) for start in starts]
+
+
+def assign_chunks(windows: np.ndarray, chunks: List[Tuple[int, int]]) -> np.ndarray:
+    """
+    For every `[start, end)` frame window, the index of the first chunk that contains it,
+    or -1 if no single chunk does.
+    """
+
+    windows = np.asarray(windows, dtype=np.int64).reshape(-1, 2)
+    bounds = np.asarray(chunks, dtype=np.int64).reshape(-1, 2)
+    inside = (bounds[None, :, 0] <= windows[:, None, 0]) & (windows[:, None, 1] <= bounds[None, :, 1])
+    return np.where(inside.any(axis=1), inside.argmax(axis=1), -1)
+
+
+class FrameOrderError(ValueError):
+    """
+    Frames of a streamed quarter did not arrive in ascending order.
+    """
+
+
+def merge_stores(stores: List[FrameStore]) -> FrameStore:
+    """
+    Combine the stores of adjacent chunks; frames present in several keep the first copy.
+    """
+
+    bboxes_dict, keypoints_dict, tracklets = {}, {}, {}
+    for store in stores:
+        for idx, frame_id in enumerate(store.frame_ids.tolist()):
+            if frame_id in bboxes_dict:
+                continue
+            bboxes, keypoints = store.frame_arrays(idx)
+            bboxes_dict[frame_id] = bboxes
+            if keypoints is not None:
+                keypoints_dict[frame_id] = keypoints
+            tracklets[frame_id] = store.tracklets.get(frame_id + store.tracklet_offset)
+    return FrameStore.from_columns(bboxes_dict, tracklets, keypoints_dict, stores[0].schema_id if stores else COCO_WHOLEBODY.schema_id)
+
+
+def manifest_path(annotation_file: str) -> str:
+    return f"{os.path.splitext(annotation_file)[0]}{MANIFEST_SUFFIX}"
+
+
+def chunk_path(annotation_file: str, start: int, end: int) -> str:
+    return f"{os.path.splitext(annotation_file)[0]}.{start:06d}-{end:06d}{BINARY_EXT}"
+
+
+@timed("write_chunks")
+def save_chunked_annotation(
+    header: VideoAnnotation,
+    frames: Iterable[Tuple[int, Optional[np.ndarray], Any]],
+    annotation_file: str,
+    chunk_frames: int,
+    overlap: int = DEFAULT_CHUNK_OVERLAP,
+) -> List[Tuple[int, int]]:
+    """
+    Write a quarter as overlapping chunks of `chunk_frames` frames plus a manifest, in
+    place of the single file `annotation_file`. `frames` yields `(frame_number, bboxes,
+    tracklet)` in ascending frame order, `None` where a frame has no bboxes or tracklet,
+    and `header` holds the remaining `VideoAnnotation` fields. Each chunk is built and
+    written as soon as its last frame has been read, so only the frames of the open chunk
+    are held in memory. The windows match `frame_chunks` over the whole quarter.
+    Returns the chunk windows; chunks already written are removed if reading `frames` fails.
+    """
+
+    assert chunk_frames > overlap, f"chunk_frames ({chunk_frames}) must be larger than overlap ({overlap})"
+    chunks: List[Tuple[int, int]] = []
+    buffered = {}
+
+    def write_chunk(start: int, end: int):
+        bboxes_dict = {frame: bboxes for frame, (bboxes, _) in buffered.items() if frame < end and bboxes is not None}
+        tracklets = {frame: tracklet for frame, (_, tracklet) in buffered.items() if frame < end}
+        chunk = header.model_copy(update={"frames": FrameStore.from_columns(bboxes_dict, tracklets)})
+        save_annotation(chunk, chunk_path(annotation_file, start, end))
+        chunks.append((start, end))
+
+    try:
+        start, last = None, None
+        for frame, bboxes, tracklet in frames:
+            if last is not None and frame <= last:
+                raise FrameOrderError(f"frame {frame} of {annotation_file} follows frame {last}")
+            if start is None:
+                start = frame
+            while frame >= start + chunk_frames:
+                write_chunk(start, start + chunk_frames)
+                start += chunk_frames - overlap
+                for stale in [f for f in buffered if f < start]:
+                    del buffered[stale]
+            buffered[frame] = (bboxes, tracklet)
+            last = frame
+        # the last chunk ends at the last frame, unless the previous chunk already covers it
+        if start is not None and (not chunks or start < last + 1 - overlap):
+            write_chunk(start, last + 1)
+    except BaseException:
+        # without a manifest the chunks are unreachable, don't leave them behind
+        for start, end in chunks:
+            os.remove(chunk_path(annotation_file, start, end))
+        raise
+    count("chunks_written", len(chunks))
+
+    manifest = {
+        "video_id": header.video_id,
+        "video_path": header.video_path,
+        "caption": header.caption,
+        "overlap": overlap,
+        "chunks": [[start, end, os.path.basename(chunk_path(annotation_file, start, end))] for start, end in chunks],
+    }
+    write_atomic(manifest_path(annotation_file), json.dumps(manifest).encode("utf-8"))
+    return chunks
+
+
+class ChunkedQuarter:
+    """
+    Read access to a quarter written by `save_chunked_annotation`, holding at most one
+    chunk in memory (two while a window straddles a chunk boundary).
+    """
+
+    def __init__(self, annotation_file: str):
+        self.annotation_file = annotation_file
+        with open(manifest_path(annotation_file), "r") as f:
+            self.manifest = json.load(f)
+        self.chunks = [(start, end) for start, end, _ in self.manifest["chunks"]]
+        directory = os.path.dirname(annotation_file)
+        self.paths = [os.path.join(directory, name) for _, _, name in self.manifest["chunks"]]
+        self._cached: Tuple[Optional[int], Optional[VideoAnnotation]] = (None, None)
+
+    @staticmethod
+    def exists(annotation_file: str) -> bool:
+        return os.path.exists(manifest_path(annotation_file))
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    @timed("load_chunk")
+    def load(self, idx: int) -> VideoAnnotation:
+        """
+        Annotation holding the frames of chunk `idx`, with their quarter frame ids.
+        """
+
+        if self._cached[0] != idx:
+            # drop the previous chunk before loading the next one
+            self._cached = (None, None)
+            with open(self.paths[idx], "rb") as f:
+                data = f.read()
+            count("bytes_read", len(data))
+            self._cached = (idx, load_annotation(data, BINARY_EXT))
+        return self._cached[1]
+
+    def window(self, start_frame: int, end_frame: int) -> VideoAnnotation:
+        """
+        Annotation holding frames `[start_frame, end_frame)`, loaded from the chunk(s) covering them.
+        """
+
+        chunk = int(assign_chunks([[start_frame, end_frame]], self.chunks)[0])
+        if chunk >= 0:
+            annotation = self.load(chunk)
+            return annotation.model_copy(update={"frames": annotation.frames.window(start_frame, end_frame)})
+
+        # windows longer than the overlap, or sticking out past the first or last chunk, end up here
+        stores = [
+            self.load(idx).frames.window(start_frame, end_frame)
+            for idx, (start, end) in enumerate(self.chunks)
+            if start < end_frame and start_frame < end
+        ]
+        return VideoAnnotation(
+            video_id=self.manifest["video_id"],
+            video_path=self.manifest["video_path"],
+            frames=merge_stores(stores),
+            caption=self.manifest["caption"],
+        )
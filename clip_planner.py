@@ -0,0 +1,181 @@
+"""
+Planning for overlap-aware clip extraction. Clips are fixed windows around HUDL
+events and consecutive events (assist -> made shot -> rebound) overlap almost
+entirely, so windows are grouped into super-segments and every super-segment is read
+from the full-quarter replay once by a single ffmpeg call that writes all of its clips.
+Stream copy can only start a clip on a keyframe, so every cut is snapped to the last
+keyframe at or before the clip start, the same frame a direct input seek starts on.
+"""
+
+import os
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from frame_timing import PROBE_CACHE_DIR, load_packets
+from profiling import timed, count
+
+# ffprobe prints timestamps with microsecond precision, output seeks keep a little slack
+_SEEK_EPS = 1e-3
+
+
+class Segment(NamedTuple):
+    """
+    A span of the source replay covering one or more clip windows.
+    `clips` are indices into the windows the segment was planned from.
+    """
+
+    start: float
+    end: float
+    clips: List[int]
+
+
+def group_windows(windows: np.ndarray, gap: float = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Merge overlapping `[start, end)` windows. Windows separated by at most `gap` are merged too.
+    Returns the sorted, disjoint merged ranges as an (n_ranges, 2) array and, for every
+    input window, the index of the range that contains it.
+    """
+
+    windows = np.asarray(windows).reshape(-1, 2)
+    if len(windows) == 0:
+        return np.empty((0, 2), dtype=windows.dtype), np.empty(0, dtype=np.int64)
+
+    order = np.argsort(windows[:, 0], kind="stable")
+    sorted_windows = windows[order]
+    reach = np.maximum.accumulate(sorted_windows[:, 1])
+    # a new range starts wherever a window begins past everything seen so far
+    new_range = np.r_[True, sorted_windows[1:, 0] > reach[:-1] + gap]
+    starts = np.flatnonzero(new_range)
+    ends = np.r_[starts[1:], len(sorted_windows)] - 1
+
+    ranges = np.stack([sorted_windows[starts, 0], reach[ends]], axis=1)
+    labels = np.empty(len(windows), dtype=np.int64)
+    labels[order] = np.cumsum(new_range) - 1
+    return ranges, labels
+
+
+def plan_segments(windows: np.ndarray, gap: float = 0.0, max_length: Optional[float] = 120.0) -> List[Segment]:
+    """
+    Plan super-segments for clip windows given in seconds.
+    Overlapping windows share a segment; a segment is closed before it would grow past
+    `max_length` seconds so a busy quarter doesn't turn into a single full-quarter copy.
+    """
+
+    windows = np.asarray(windows, dtype=np.float64).reshape(-1, 2)
+    ranges, labels = group_windows(windows, gap)
+
+    segments = []
+    for range_idx in range(len(ranges)):
+        members = np.flatnonzero(labels == range_idx)
+        members = members[np.argsort(windows[members, 0], kind="stable")]
+
+        current: List[int] = []
+        start = end = 0.0
+        for clip in members:
+            clip_start, clip_end = windows[clip]
+            if current and max_length is not None and max(end, clip_end) - start > max_length:
+                segments.append(Segment(start, end, current))
+                current = []
+            if not current:
+                start, end = float(clip_start), float(clip_end)
+            current.append(int(clip))
+            end = max(end, float(clip_end))
+        segments.append(Segment(start, end, current))
+
+    return segments
+
+
+def keyframe_times(video_path: str, cache_dir: Optional[str] = PROBE_CACHE_DIR) -> np.ndarray:
+    """
+    Seconds since the first frame of every keyframe of `video_path`, from the shared probe
+    cache. Empty if the replay is missing or couldn't be probed.
+    """
+
+    if not os.path.exists(video_path):
+        return np.empty(0, dtype=np.float64)
+    pts, keyframe = load_packets(video_path, cache_dir)
+    return pts[keyframe] - pts[0] if len(pts) else pts
+
+
+def snap_to_keyframes(times: np.ndarray, keyframes: np.ndarray) -> np.ndarray:
+    """
+    Last keyframe at or before each of `times` (seconds), where an input seek with stream
+    copy starts. Times before the first keyframe snap to 0.
+    """
+
+    times = np.asarray(times, dtype=np.float64)
+    idx = np.searchsorted(keyframes, times + 1e-6, side="right") - 1
+    return np.where(idx >= 0, keyframes[np.maximum(idx, 0)], 0.0)
+
+
+@timed("ffmpeg")
+def ffmpeg_cut(source: str, start: float, duration: float, output_path: str):
+    """
+    Stream-copy `duration` seconds of `source` starting at `start` into `output_path`.
+    """
+
+    count("ffmpeg_calls")
+    os.system(
+        f'ffmpeg -ss {start} -t {duration} -hide_banner -loglevel error -n -i "{source}" -vcodec copy -acodec copy "{output_path}"')
+
+
+@timed("ffmpeg")
+def ffmpeg_split(source: str, start: float, duration: float, clips: Sequence[Tuple[float, float, str]]):
+    """
+    Read `duration` seconds of `source` starting at `start` once and stream-copy every
+    `(offset, clip_duration, output_path)` of `clips` out of it, offsets relative to `start`.
+    `start` and every `start + offset` must be keyframes, otherwise ffmpeg drops the frames
+    up to the next keyframe and the clip starts late.
+    """
+
+    count("ffmpeg_calls")
+    outputs = " ".join(
+        f'-map 0:v:0 -map 0:a:0? -ss {max(offset - _SEEK_EPS, 0.0)} -t {clip_duration} -vcodec copy -acodec copy "{output_path}"'
+        for offset, clip_duration, output_path in clips
+    )
+    os.system(
+        f'ffmpeg -ss {start} -t {duration} -hide_banner -loglevel error -n -i "{source}" {outputs}')
+
+
+def extract_clips(
+    source: str,
+    windows: np.ndarray,
+    output_paths: Sequence[str],
+    probe_cache_dir: Optional[str] = PROBE_CACHE_DIR,
+    **plan_kwargs,
+) -> List[Segment]:
+    """
+    Cut every `[start, end)` window of `source` (seconds) into the matching output path.
+    Clips that overlap nothing are cut directly; the clips of a super-segment are all
+    written by one ffmpeg call that reads the segment span once, with no intermediate file.
+    Every clip starts on the keyframe `ffmpeg_cut` would start it on, so both paths cut
+    alike. Without keyframe positions every clip is cut directly. Returns the plan that was executed.
+    """
+
+    windows = np.asarray(windows, dtype=np.float64).reshape(-1, 2)
+    segments = plan_segments(windows, **plan_kwargs)
+    keyframes = keyframe_times(source, probe_cache_dir)
+    if len(keyframes) == 0 and any(len(segment.clips) > 1 for segment in segments):
+        print(f"Warning: no keyframes for {source}, cutting every clip on its own")
+
+    for segment in segments:
+        if len(segment.clips) == 1 or len(keyframes) == 0:
+            for clip in segment.clips:
+                if not os.path.exists(output_paths[clip]):
+                    ffmpeg_cut(source, windows[clip, 0], windows[clip, 1] - windows[clip, 0], output_paths[clip])
+            continue
+
+        # the input seek lands on the keyframe before the segment, clips are cut relative to it
+        clip_starts = snap_to_keyframes(windows[segment.clips, 0], keyframes)
+        segment_start = float(clip_starts.min())
+        clips = [
+            (clip_start - segment_start, windows[clip, 1] - clip_start, output_paths[clip])
+            for clip, clip_start in zip(segment.clips, clip_starts.tolist())
+            # `-n` makes ffmpeg fail the whole call if any output exists
+            if not os.path.exists(output_paths[clip])
+        ]
+        if clips:
+            ffmpeg_split(source, segment_start, segment.end - segment_start, clips)
+
+    return segments
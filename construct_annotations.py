@@ -1,65 +1,114 @@
 import os
 import json
-import csv
-from typing import List, Dict
-from annot_types import Bbox, Tracklet, ActionAnnotation, FrameAnnotation, VideoAnnotation, ActionName
+import heapq
+import itertools
+import numpy as np
+from typing import Any, List, Dict, Iterator, Optional, Tuple, Union
+from annotation_io import AnnotationWriter, save_annotation
+from chunking import ChunkedQuarter, DEFAULT_CHUNK_OVERLAP, FrameOrderError, save_chunked_annotation
+from profiling import timed, count, enable_run_log, write_summary
+from hudl_logs import load_hudl_log, known_actions, action_annotations_from_df
+from annot_types import Bbox, Tracklet, ActionAnnotation, VideoAnnotation, FrameStore, BBOX_COLUMNS
 
 
-def load_2d_player_positions(file_path: str) -> Dict[int, Tracklet]:
-    """"""
+@timed('load_positions')
+def load_2d_player_positions(file_path: str, lazy: bool = False) -> Dict[int, Tracklet]:
+    """
+    With `lazy`, tracklets are kept as raw dicts and only validated when their frame is accessed.
+    """
     tracklets = {}
     with open(file_path, 'r') as f:
         data = json.load(f)
         for frame_number, tracklet_data in data.items():
-            if tracklet_data:
-                tracklet = Tracklet(frame_number=int(frame_number), **tracklet_data)
-                tracklets[int(frame_number)] = tracklet
-            else:
-                tracklets[int(frame_number)] = None
+            tracklets[int(frame_number)] = _tracklet(int(frame_number), tracklet_data, lazy)
     return tracklets
 
-def load_hudl_game_logs(file_path: str) -> List[ActionAnnotation]:
-    action_annotations = []
+
+def _tracklet(frame_number: int, tracklet_data: Optional[dict], lazy: bool) -> Union[Tracklet, dict, None]:
+    if tracklet_data and lazy:
+        return {'frame_number': frame_number, **tracklet_data}
+    elif tracklet_data:
+        return Tracklet(frame_number=frame_number, **tracklet_data)
+    return None
+
+
+def iter_json_items(file_path: str, buffer_size: int = 1 << 20) -> Iterator[Tuple[str, Any]]:
+    """
+    `(key, value)` pairs of the top-level JSON object in `file_path`, in file order.
+    The file is read `buffer_size` characters at a time and decoded one value at a time,
+    so the whole object is never held in memory.
+    """
+    decoder = json.JSONDecoder()
     with open(file_path, 'r') as f:
-        reader = csv.DictReader(f, delimiter=';')
-        for row in reader:
-            try:
-                action_name = ActionName(row['action_name'])
-                player_id = ActionName(row['player_id'])
-            except ValueError:
-                continue
-            action_annotations.append(ActionAnnotation(
-                annotation_id=int(row['id']),
-                action_id=int(row['action_id']),
-                action_name=ActionName(row['action_name']),
-                player_id=int(row['player_id']),
-                player_name=row['player_name'],
-                team_id=int(row['team_id']),
-                team_name=row['team_name'],
-                half=int(row['half']),
-                second=float(row['second']),
-                pos_x=float(row['pos_x']) if row['pos_x'] else None,
-                pos_y=float(row['pos_y']) if row['pos_y'] else None,
-                opponent_id=int(row['opponent_id']) if row['opponent_id'] else None,
-                opponent_name=row['opponent_name'] if row['opponent_name'] else None,
-                opponent_team_id=int(row['opponent_team_id']) if row['opponent_team_id'] else None,
-                opponent_team_name=row['opponent_team_name'] if row['opponent_team_name'] else None,
-                teammate_id=int(row['teammate_id']) if row['teammate_id'] else None,
-                teammate_name=row['teammate_name'] if row['teammate_name'] else None,
-                possession_id=int(row['possession_id']) if row['possession_id'] else None,
-                possession_name=row['possession_name'] if row['possession_name'] else None,
-                possession_team_id=int(row['possession_team_id']) if row['possession_team_id'] else None,
-                possession_team_name=row['possession_team_name'] if row['possession_team_name'] else None,
-                possession_number=int(row['possession_number']) if row['possession_number'] else None,
-                possession_start_clear=float(row['possession_start_clear']) if row['possession_start_clear'] else None,
-                playtype=row['playtype'] if row['playtype'] else None,
-                hand=row['hand'] if row['hand'] else None,
-                shot_type=row['shot_type'] if row['shot_type'] else None,
-                drive=row['drive'] if row['drive'] else None,
-                dribble_move=row['dribble_move'] if row['dribble_move'] else None,
-                contesting=row['contesting'] if row['contesting'] else None,
-            ))
-    return action_annotations
+        buf, pos, eof = '', 0, False
+
+        def fill():
+            nonlocal buf, pos, eof
+            data = f.read(buffer_size)
+            eof = len(data) < buffer_size
+            buf, pos = buf[pos:] + data, 0
+
+        def skip_space():
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos].isspace():
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                fill()
+
+        def next_char() -> str:
+            nonlocal pos
+            skip_space()
+            if pos >= len(buf):
+                raise ValueError(f'{file_path}: unexpected end of JSON')
+            pos += 1
+            return buf[pos - 1]
+
+        def next_value() -> Any:
+            nonlocal pos
+            while True:
+                skip_space()
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    # a value ending at the buffer end may be cut short, e.g. a number
+                    if end < len(buf) or eof:
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill()
+
+        if next_char() != '{':
+            raise ValueError(f'{file_path}: expected a JSON object')
+        skip_space()
+        if pos < len(buf) and buf[pos] == '}':
+            return
+        while True:
+            key = next_value()
+            if next_char() != ':':
+                raise ValueError(f'{file_path}: expected ":" after key {key!r}')
+            yield key, next_value()
+            char = next_char()
+            if char == '}':
+                return
+            if char != ',':
+                raise ValueError(f'{file_path}: expected "," or "}}" after the value of {key!r}')
+
+
+def iter_2d_player_positions(file_path: str, lazy: bool = False) -> Iterator[Tuple[int, Union[Tracklet, dict, None]]]:
+    """
+    Streaming variant of `load_2d_player_positions`: `(frame_number, tracklet)` in file order.
+    """
+    for frame_number, tracklet_data in iter_json_items(file_path):
+        yield int(frame_number), _tracklet(int(frame_number), tracklet_data, lazy)
+
+def load_hudl_game_logs(file_path: str) -> List[ActionAnnotation]:
+    """
+    All rows of a HUDL log with a known `ActionName`, parsed through the shared cached loader.
+    """
+    return action_annotations_from_df(known_actions(load_hudl_log(file_path)))
 
 
 def load_player_bbox(file_path: str) -> dict:
@@ -83,7 +132,86 @@ def load_player_bbox(file_path: str) -> dict:
     return bboxes_dict
 
 
-def generate_video_annotation(video_id: int, video_path: str, quarter: str, data_dir: str) -> VideoAnnotation:
+@timed('load_bboxes')
+def load_player_bbox_array(file_path: str) -> Dict[int, np.ndarray]:
+    """
+    Columnar variant of `load_player_bbox`: maps frame number to a (n_bboxes, 7)
+    array laid out as `BBOX_COLUMNS`, without building a `Bbox` per row.
+    """
+    rows = np.loadtxt(file_path, delimiter=',', usecols=range(len(BBOX_COLUMNS)), ndmin=2)
+    if rows.size == 0:
+        return {}
+    rows = rows[np.argsort(rows[:, 0], kind='stable')]
+    frame_numbers, starts = np.unique(rows[:, 0].astype(np.int64), return_index=True)
+    return {int(f): chunk for f, chunk in zip(frame_numbers, np.split(rows, starts[1:]))}
+
+
+def iter_player_bbox_arrays(file_path: str, block_lines: int = 1 << 16) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Streaming variant of `load_player_bbox_array` for files sorted by frame: yields
+    `(frame_number, bboxes)` per frame, parsing `block_lines` lines at a time.
+    """
+    carry = np.empty((0, len(BBOX_COLUMNS)))
+    with open(file_path, 'r') as f:
+        while True:
+            lines = [line for line in itertools.islice(f, block_lines) if line.strip()]
+            if not lines:
+                break
+            rows = np.loadtxt(lines, delimiter=',', usecols=range(len(BBOX_COLUMNS)), ndmin=2)
+            # the last frame of a block may continue in the next one
+            rows = np.concatenate([carry, rows])
+            frame_numbers = rows[:, 0].astype(np.int64)
+            if np.any(np.diff(frame_numbers) < 0):
+                raise FrameOrderError(f'{file_path} is not sorted by frame')
+            groups = np.split(rows, np.flatnonzero(np.diff(frame_numbers)) + 1)
+            for group in groups[:-1]:
+                yield int(group[0, 0]), group
+            carry = groups[-1]
+    if len(carry):
+        yield int(carry[0, 0]), carry
+
+
+def iter_quarter_frames(
+    player_positions_path: Optional[str],
+    player_bbox_paths: List[str],
+    lazy: bool = False,
+    in_memory: bool = False,
+) -> Iterator[Tuple[int, Optional[np.ndarray], Union[Tracklet, dict, None]]]:
+    """
+    `(frame_number, bboxes, tracklet)` for every frame of a quarter in ascending order,
+    merged from the positions and bbox files while they are read; `None` where a frame
+    is missing from one of them. With `in_memory`, the files are loaded whole and sorted
+    instead, for inputs that are not in frame order.
+    """
+    if in_memory:
+        positions = sorted(load_2d_player_positions(player_positions_path, lazy).items()) if player_positions_path else []
+        bboxes = [sorted(load_player_bbox_array(path).items()) for path in player_bbox_paths]
+    else:
+        positions = iter_2d_player_positions(player_positions_path, lazy) if player_positions_path else []
+        bboxes = [iter_player_bbox_arrays(path) for path in player_bbox_paths]
+
+    # sources are merged in order, so a frame in several bbox files keeps the last one like `generate_video_annotation`
+    streams = [((frame, None, tracklet) for frame, tracklet in positions)]
+    streams += [((frame, rows, None) for frame, rows in stream) for stream in bboxes]
+    num_frames, num_bboxes = 0, 0
+    for frame, items in itertools.groupby(heapq.merge(*streams, key=lambda item: item[0]), key=lambda item: item[0]):
+        frame_bboxes, tracklet = None, None
+        for _, rows, frame_tracklet in items:
+            if rows is not None:
+                frame_bboxes = rows
+            else:
+                tracklet = frame_tracklet
+        num_frames += 1
+        num_bboxes += 0 if frame_bboxes is None else len(frame_bboxes)
+        yield frame, frame_bboxes, tracklet
+    count('frames', num_frames)
+    count('bboxes', num_bboxes)
+
+
+def quarter_input_paths(video_id: int, quarter: str, data_dir: str) -> Tuple[Optional[str], List[str]]:
+    """
+    The 2D player positions file (if any) and the player bbox files of a quarter.
+    """
     quarter_map = {
         'period1': 'Q1',
         'period2': 'Q2',
@@ -102,28 +230,29 @@ def generate_video_annotation(video_id: int, video_path: str, quarter: str, data
         os.path.join(data_dir, 'player-tracklets', file) for file in os.listdir(os.path.join(data_dir, 'player-tracklets')) if str(video_id) in file and quarter.lower() in file
     ]
 
+    if not player_positions_path:
+        print(f"Warning: 2D player positions file not found for video ID {video_id}, quarter {quarter}")
+    if not player_bbox_paths:
+        print(f"Warning: Player bbox files not found for video ID {video_id}, quarter {quarter}")
+    return player_positions_path, player_bbox_paths
+
+
+def generate_video_annotation(video_id: int, video_path: str, quarter: str, data_dir: str, lazy: bool = False) -> VideoAnnotation:
+    player_positions_path, player_bbox_paths = quarter_input_paths(video_id, quarter, data_dir)
+
     tracklets = {}
     if player_positions_path:
-        tracklets = load_2d_player_positions(player_positions_path)
-    else:
-        print(f"Warning: 2D player positions file not found for video ID {video_id}, quarter {quarter}")
+        tracklets = load_2d_player_positions(player_positions_path, lazy)
 
     bboxes_dict = {}
-    if player_bbox_paths:
-        for path in player_bbox_paths:
-            bboxes_dict.update(load_player_bbox(path))
-    else:
-        print(f"Warning: Player bbox files not found for video ID {video_id}, quarter {quarter}")
-
-    frames = []
-    all_frame_numbers = sorted(set(list(tracklets.keys()) + list(bboxes_dict.keys())))
+    for path in player_bbox_paths:
+        bboxes_dict.update(load_player_bbox_array(path))
 
-    for frame_number in all_frame_numbers:
-        frames.append(FrameAnnotation(
-            frame_id=frame_number,
-            bbox=bboxes_dict.get(frame_number, []),
-            tracklet=tracklets.get(frame_number)
-        ))
+    # frames are built lazily from the columnar bboxes, see `FrameStore`
+    with timed('build_frames'):
+        frames = FrameStore.from_columns(bboxes_dict, tracklets)
+    count('frames', len(frames))
+    count('bboxes', len(frames.bboxes))
 
     return VideoAnnotation(
         video_id=video_id,
@@ -132,35 +261,80 @@ def generate_video_annotation(video_id: int, video_path: str, quarter: str, data
         caption=f'Annotation for video {video_id}, {quarter}'
     )
 
-def main():
-    data_dir = '.'
+def construct_quarter_annotation(
+    video_file: str,
+    game_replays_dir: str,
+    output_folder: str,
+    data_dir: str,
+    writer: Optional[AnnotationWriter] = None,
+    chunk_frames: Optional[int] = None,
+    overlap: int = DEFAULT_CHUNK_OVERLAP,
+) -> bool:
+    """
+    Build and save the annotation of a single replay. Without a `writer` the file is
+    written before returning, with one it is only queued and the writer reports whether
+    it was saved. Returns `False` if the annotation could not be generated.
+    With `chunk_frames`, the quarter is streamed from its input files and written as
+    overlapping chunks (see `chunking`), so only one chunk is ever held in memory, and
+    tracklets are only validated chunk by chunk while serializing.
+    """
+    video_id = int(video_file.split('_')[0])
+    quarter = next(part for part in video_file.split('_') if part.startswith('period')).split('.')[0]
+    video_path = os.path.join(game_replays_dir, video_file)
+
+    # Check if the annotation file already exists, writes are atomic so it is complete
+    output_file = f'{output_folder}/{video_id}_{quarter}_video_annotation.json'
+    if os.path.exists(output_file) or ChunkedQuarter.exists(output_file):
+        print(f'Annotation file for video ID {video_id}, quarter {quarter} already exists. Skipping.')
+        return True
+
+    try:
+        if chunk_frames is not None:
+            input_paths = quarter_input_paths(video_id, quarter, data_dir)
+            header = VideoAnnotation(
+                video_id=video_id,
+                video_path=video_path,
+                frames=[],
+                caption=f'Annotation for video {video_id}, {quarter}'
+            )
+            try:
+                save_chunked_annotation(header, iter_quarter_frames(*input_paths, lazy=True), output_file, chunk_frames, overlap)
+            except FrameOrderError as e:
+                print(f'Warning: {e}, loading the whole quarter to sort it')
+                save_chunked_annotation(header, iter_quarter_frames(*input_paths, lazy=True, in_memory=True), output_file, chunk_frames, overlap)
+            print(f'Generated annotation for video ID {video_id}, quarter {quarter}')
+            return True
+
+        with timed('generate_video_annotation'):
+            video_annotation = generate_video_annotation(video_id, video_path, quarter, data_dir)
+        if writer is not None:
+            writer.submit(video_annotation, output_file)
+            print(f'Generated annotation for video ID {video_id}, quarter {quarter}, queued for writing')
+        else:
+            save_annotation(video_annotation, output_file)
+            print(f'Generated annotation for video ID {video_id}, quarter {quarter}')
+        return True
+    except FileNotFoundError as e:
+        print(f'Error generating annotation for video ID {video_id}, quarter {quarter}: {e}')
+    except Exception as e:
+        print(f'Unexpected error for video ID {video_id}, quarter {quarter}: {e}')
+    return False
+
+
+def main(data_dir: str = '.', output_folder: str = 'annotations', chunk_frames: Optional[int] = None):
     game_replays_dir = os.path.join(data_dir, 'game-replays')
     video_files = [f for f in os.listdir(game_replays_dir) if f.endswith('.mp4')]
-    output_folder = 'annotations'
 
     # Ensure the output folder exists
     os.makedirs(output_folder, exist_ok=True)
 
-    for video_file in video_files:
-        video_id = int(video_file.split('_')[0])
-        quarter = next(part for part in video_file.split('_') if part.startswith('period')).split('.')[0]
-        video_path = os.path.join(game_replays_dir, video_file)
-        
-        # Check if the annotation file already exists
-        output_file = f'{output_folder}/{video_id}_{quarter}_video_annotation.json'
-        if os.path.exists(output_file):
-            print(f'Annotation file for video ID {video_id}, quarter {quarter} already exists. Skipping.')
-            continue
-
-        try:
-            video_annotation = generate_video_annotation(video_id, video_path, quarter, data_dir)
-            with open(output_file, 'w') as f:
-                json.dump(video_annotation.dict(), f, indent=4)
-            print(f'Generated annotation for video ID {video_id}, quarter {quarter}')
-        except FileNotFoundError as e:
-            print(f'Error generating annotation for video ID {video_id}, quarter {quarter}: {e}')
-        except Exception as e:
-            print(f'Unexpected error for video ID {video_id}, quarter {quarter}: {e}')
+    # a quarter is serialized and written in the background while the next one is built,
+    # at most one more waits in the queue so only ~3 full quarters are alive at once
+    with AnnotationWriter(num_workers=1, max_pending=1) as writer:
+        for video_file in video_files:
+            construct_quarter_annotation(video_file, game_replays_dir, output_folder, data_dir, writer, chunk_frames)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    enable_run_log()
+    main()
+    write_summary()
\ No newline at end of file
@@ -0,0 +1,217 @@
+"""
+Pack `clips` and `clip-annotations` into WebDataset-style tar shards.
+Every sample is stored as consecutive `<key>.mp4` / `<key>.json` (or `<key>.npz`) members,
+shards are closed once they reach `shard_size` bytes, and an `index.json` records the
+byte range of every member so single samples can also be read without scanning a shard.
+"""
+
+import os
+import io
+import json
+import random
+import tarfile
+from glob import glob
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from annotation_io import BINARY_EXT, JSON_EXT, dump_annotation, load_annotation
+
+INDEX_FILE = "index.json"
+TAR_BLOCK = tarfile.BLOCKSIZE
+
+
+def find_samples(clips_dir: str, annotations_dir: str) -> List[Tuple[str, str, str]]:
+    """
+    Pair every clip under `clips/<game>/<period>` with its annotation under
+    `clip-annotations/<game>/<period>`. Returns `(key, clip_path, annotation_path)` triplets.
+    """
+
+    samples = []
+    for clip_path in sorted(glob(os.path.join(clips_dir, "*", "*", "*.mp4"))):
+        rel_dir = os.path.relpath(os.path.dirname(clip_path), clips_dir)
+        key = os.path.basename(clip_path)[: -len(".mp4")]
+        annotation_path = os.path.join(annotations_dir, rel_dir, f"{key}_annotation.json")
+        if not os.path.exists(annotation_path):
+            print(f"Warning: annotation not found for {clip_path}. Skipping.")
+            continue
+        samples.append((key, clip_path, annotation_path))
+    return samples
+
+
+class ShardWriter:
+    """
+    Writes samples into `shard-000000.tar`, `shard-000001.tar`, ... and keeps track of
+    the byte range of every member for the index.
+    """
+
+    def __init__(self, output_dir: str, shard_size: int = 1 << 30):
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        self.shards: List[Dict] = []
+        self._tar: Optional[tarfile.TarFile] = None
+        os.makedirs(output_dir, exist_ok=True)
+
+    def _open_shard(self):
+        name = f"shard-{len(self.shards):06d}.tar"
+        self._tar = tarfile.open(os.path.join(self.output_dir, name), "w", format=tarfile.GNU_FORMAT)
+        self.shards.append({"path": name, "size": 0, "samples": []})
+
+    def _close_shard(self):
+        if self._tar is not None:
+            self._tar.close()
+            shard = self.shards[-1]
+            shard["size"] = os.path.getsize(os.path.join(self.output_dir, shard["path"]))
+            self._tar = None
+
+    def _add_member(self, name: str, data: bytes) -> Tuple[int, int]:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        self._tar.addfile(info, io.BytesIO(data))
+        # data is padded to a full block and ends where the tar offset now is
+        padded = -(-len(data) // TAR_BLOCK) * TAR_BLOCK
+        return self._tar.offset - padded, len(data)
+
+    def write(self, key: str, members: Dict[str, bytes]):
+        """
+        Write one sample. `members` maps an extension (e.g. ".mp4") to its payload.
+        """
+
+        if self._tar is None or self._tar.offset >= self.shard_size:
+            self._close_shard()
+            self._open_shard()
+
+        entry = {"key": key, "members": {}}
+        for ext, data in members.items():
+            entry["members"][ext] = self._add_member(f"{key}{ext}", data)
+        self.shards[-1]["samples"].append(entry)
+
+    def close(self) -> str:
+        """
+        Finish the last shard and write the index. Returns the index path.
+        """
+
+        self._close_shard()
+        index_path = os.path.join(self.output_dir, INDEX_FILE)
+        with open(index_path, "w") as f:
+            json.dump({"shards": self.shards}, f)
+        return index_path
+
+
+def export_shards(
+    clips_dir: str,
+    annotations_dir: str,
+    output_dir: str,
+    shard_size: int = 1 << 30,
+    annotation_ext: str = JSON_EXT,
+) -> str:
+    """
+    Pack all clips and their annotations into shards of roughly `shard_size` bytes.
+    With `annotation_ext=".npz"` annotations are stored in the binary format.
+    """
+
+    writer = ShardWriter(output_dir, shard_size)
+    for key, clip_path, annotation_path in find_samples(clips_dir, annotations_dir):
+        with open(clip_path, "rb") as f:
+            clip = f.read()
+        with open(annotation_path, "rb") as f:
+            annotation = f.read()
+        if annotation_ext != JSON_EXT:
+            annotation = dump_annotation(load_annotation(annotation, JSON_EXT, lazy=True), annotation_ext)
+        writer.write(key, {".mp4": clip, annotation_ext: annotation})
+    return writer.close()
+
+
+class ShardReader:
+    """
+    Streams samples out of an exported shard directory.
+    Shards are read sequentially start to end; shuffling happens at shard level plus
+    an optional in-memory buffer, so reads stay at disk bandwidth.
+    """
+
+    def __init__(self, shard_dir: str):
+        self.shard_dir = shard_dir
+        with open(os.path.join(shard_dir, INDEX_FILE), "r") as f:
+            self.shards = json.load(f)["shards"]
+        self._locations = {
+            sample["key"]: (shard["path"], sample["members"]) for shard in self.shards for sample in shard["samples"]
+        }
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    def keys(self) -> List[str]:
+        return list(self._locations)
+
+    def iter_samples(
+        self,
+        shuffle: bool = False,
+        seed: Optional[int] = None,
+        buffer_size: int = 0,
+        rank: int = 0,
+        world_size: int = 1,
+        decode: bool = True,
+    ) -> Iterator[Dict]:
+        """
+        Yield `{"key", ".mp4", <annotation ext>}` dicts. With `world_size > 1` every
+        rank gets a disjoint subset of shards. `buffer_size` additionally shuffles samples
+        across neighbouring positions. With `decode`, annotations are returned as
+        `VideoAnnotation` objects instead of raw bytes.
+        """
+
+        rng = random.Random(seed)
+        paths = [shard["path"] for shard in self.shards][rank::world_size]
+        if shuffle:
+            rng.shuffle(paths)
+
+        buffer: List[Dict] = []
+        for path in paths:
+            for sample in self._iter_shard(path, decode):
+                if buffer_size <= 0:
+                    yield sample
+                    continue
+                buffer.append(sample)
+                if len(buffer) >= buffer_size:
+                    yield buffer.pop(rng.randrange(len(buffer)))
+
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def _iter_shard(self, path: str, decode: bool) -> Iterator[Dict]:
+        sample: Dict = {}
+        with tarfile.open(os.path.join(self.shard_dir, path), "r|") as tar:
+            for member in tar:
+                key, ext = os.path.splitext(member.name)
+                if sample and sample["key"] != key:
+                    yield sample
+                    sample = {}
+                sample["key"] = key
+                sample[ext] = self._decode(tar.extractfile(member).read(), ext, decode)
+        if sample:
+            yield sample
+
+    def read_sample(self, key: str, decode: bool = True) -> Dict:
+        """
+        Random access to a single sample through the byte ranges in the index.
+        """
+
+        path, members = self._locations[key]
+        sample = {"key": key}
+        with open(os.path.join(self.shard_dir, path), "rb") as f:
+            for ext, (offset, size) in members.items():
+                f.seek(offset)
+                sample[ext] = self._decode(f.read(size), ext, decode)
+        return sample
+
+    @staticmethod
+    def _decode(data: bytes, ext: str, decode: bool):
+        if decode and ext in (JSON_EXT, BINARY_EXT):
+            return load_annotation(data, ext)
+        return data
+
+
+if __name__ == "__main__":
+    clips_dir = "./clips"
+    annotations_dir = "./clip-annotations"
+    output_dir = "./shards"
+
+    index_path = export_shards(clips_dir, annotations_dir, output_dir)
+    print(f"Wrote shard index to {index_path}")
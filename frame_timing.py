@@ -0,0 +1,173 @@
+"""
+Map HUDL seconds to replay frame indices using the replay's own presentation timestamps.
+Broadcast replays are 29.97 fps or variable frame rate, so `int(t * 30)` drifts by
+hundreds of frames late in a quarter. The per-frame timestamps of every replay are probed
+once with ffprobe (packet headers only, nothing is decoded) and cached, and a whole
+quarter's clip windows are converted with a single `searchsorted`.
+"""
+
+import io
+import os
+import hashlib
+import subprocess
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional, Tuple
+
+import numpy as np
+
+from annotation_io import write_atomic
+from profiling import timed, count
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# nominal frame rate, used when a replay can't be probed
+DEFAULT_FPS = 30.0
+
+# default on-disk cache of probed packet timestamps and keyframe flags
+PROBE_CACHE_DIR = "./probe-cache"
+
+# ffprobe prints timestamps with microsecond precision
+_TIME_EPS = 1e-6
+
+
+@timed("ffprobe")
+def probe_packets(video_path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Presentation timestamps (seconds) and keyframe flags of every packet of the first
+    video stream, in presentation order. Returns empty arrays, with a warning, if ffprobe
+    is unavailable or fails.
+    """
+
+    count("ffprobe_calls")
+    try:
+        result = subprocess.run(
+            [
+                "ffprobe", "-v", "error", "-select_streams", "v:0",
+                "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", video_path,
+            ],
+            capture_output=True, text=True, check=True,
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Warning: ffprobe failed on {video_path}: {e}")
+        count("ffprobe_failed")
+        return np.empty(0, dtype=np.float64), np.empty(0, dtype=bool)
+
+    pts, keyframe = [], []
+    for line in result.stdout.splitlines():
+        parts = line.split(",")
+        if len(parts) < 2 or parts[0] == "N/A":
+            continue
+        pts.append(float(parts[0]))
+        keyframe.append("K" in parts[1])
+
+    # packets come in decode order, frame indices are in presentation order
+    pts = np.asarray(pts, dtype=np.float64)
+    order = np.argsort(pts, kind="stable")
+    return pts[order], np.asarray(keyframe, dtype=bool)[order]
+
+
+def probe_frame_times(video_path: str) -> np.ndarray:
+    """
+    Timestamp of every frame in seconds, relative to the first frame.
+    """
+
+    pts, _ = probe_packets(video_path)
+    return pts - pts[0] if len(pts) else pts
+
+
+@lru_cache(maxsize=256)
+def _cached_packets(video_path: str, size: int, mtime: float, cache_dir: Optional[str]) -> Tuple[np.ndarray, np.ndarray]:
+    cache_file = None
+    if cache_dir:
+        key = hashlib.sha1(f"{os.path.abspath(video_path)}:{size}:{mtime}".encode("utf-8")).hexdigest()
+        cache_file = os.path.join(cache_dir, f"{key}.npz")
+        if os.path.exists(cache_file):
+            with np.load(cache_file) as cached:
+                return cached["pts"], cached["keyframe"]
+
+    pts, keyframe = probe_packets(video_path)
+    if cache_file and len(pts):
+        os.makedirs(cache_dir, exist_ok=True)
+        buffer = io.BytesIO()
+        np.savez(buffer, pts=pts, keyframe=keyframe)
+        write_atomic(cache_file, buffer.getvalue())
+    return pts, keyframe
+
+
+def load_packets(video_path: str, cache_dir: Optional[str] = PROBE_CACHE_DIR) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    `probe_packets` of `video_path`, cached in memory and in `cache_dir`. The cache is
+    keyed by path, size and mtime so a replaced replay is probed again. Frame timestamps
+    and keyframe indices are both derived from this, so every replay is probed once.
+    """
+
+    stat = os.stat(video_path)
+    return _cached_packets(video_path, stat.st_size, stat.st_mtime, cache_dir)
+
+
+def load_frame_times(video_path: str, cache_dir: Optional[str] = PROBE_CACHE_DIR) -> np.ndarray:
+    """
+    Frame timestamps of `video_path` relative to the first frame, see `load_packets`.
+    """
+
+    pts, _ = load_packets(video_path, cache_dir)
+    return pts - pts[0] if len(pts) else pts
+
+
+class FrameClock:
+    """
+    Converts seconds since the start of a replay to frame indices. Frame `i` is the
+    frame on screen at time `t`, i.e. the last frame with timestamp `<= t`.
+    Without timestamps it falls back to a constant `fps`, the old `int(t * FPS)`.
+    """
+
+    def __init__(self, frame_times: Optional[np.ndarray] = None, fps: float = DEFAULT_FPS):
+        self.frame_times = np.empty(0, dtype=np.float64) if frame_times is None else np.asarray(frame_times, dtype=np.float64)
+        if len(self.frame_times) > 1 and self.frame_times[-1] > self.frame_times[0]:
+            # average rate, only used to extrapolate past the last frame
+            fps = (len(self.frame_times) - 1) / (self.frame_times[-1] - self.frame_times[0])
+        self.fps = float(fps)
+
+    @classmethod
+    def from_video(cls, video_path: str, cache_dir: Optional[str] = PROBE_CACHE_DIR, fps: float = DEFAULT_FPS) -> "FrameClock":
+        if not os.path.exists(video_path):
+            print(f"Warning: {video_path} not found, assuming {fps} fps")
+            return cls(fps=fps)
+        frame_times = load_frame_times(video_path, cache_dir)
+        if len(frame_times) == 0:
+            print(f"Warning: no frame timestamps for {video_path}, assuming {fps} fps")
+        return cls(frame_times, fps)
+
+    def __len__(self) -> int:
+        return len(self.frame_times)
+
+    def frame_at(self, seconds) -> np.ndarray:
+        """
+        Frame index for every value of `seconds`. Times before the first or after the last
+        frame are extrapolated at `fps`, so clip windows past the ends keep their length.
+        """
+
+        seconds = np.asarray(seconds, dtype=np.float64)
+        if len(self.frame_times) == 0:
+            return np.trunc(seconds * self.fps).astype(np.int64)
+
+        shape = seconds.shape
+        seconds = seconds.reshape(-1)
+        frames = np.searchsorted(self.frame_times, seconds + _TIME_EPS, side="right") - 1
+        before = seconds < self.frame_times[0]
+        frames[before] = np.trunc((seconds[before] - self.frame_times[0]) * self.fps)
+        last = len(self.frame_times) - 1
+        after = seconds > self.frame_times[-1]
+        frames[after] = last + np.trunc((seconds[after] - self.frame_times[-1]) * self.fps)
+        return frames.astype(np.int64).reshape(shape)
+
+    def clip_windows(self, events: "pd.DataFrame") -> np.ndarray:
+        """
+        `[start_frame, end_frame)` of every clip as an (n, 2) array, from the `start_time` /
+        `duration` columns added by `hudl_logs.clip_events`.
+        """
+
+        start_time = events["start_time"].to_numpy(dtype=np.float64)
+        duration = events["duration"].to_numpy(dtype=np.float64)
+        return self.frame_at(np.stack([start_time - duration, start_time], axis=1).reshape(-1, 2))
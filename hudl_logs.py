@@ -0,0 +1,274 @@
+"""
+Shared loader for the `;`-separated csv files in the `hudl-game-logs` dir.
+Logs are parsed with explicit dtypes (`action_name` as a categorical) and cached
+per game, in memory and on disk, keyed by a hash of the csv contents and of the loader
+(columns, dtypes, pandas version), so each log is parsed once per dataset build no
+matter how many quarters or stages read it, and a changed loader never reads stale pickles.
+pandas is imported on first use so importing this module for its constants stays cheap.
+"""
+
+import os
+import pickle
+import hashlib
+from typing import TYPE_CHECKING, Dict, List, Optional, get_args
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+from annot_types import ActionAnnotation, ActionName
+from annotation_io import write_atomic
+from profiling import timed, count
+
+# all column names for HUDL logs, in file order
+HUDL_COLUMNS = [
+    "id",
+    "action_id",
+    "action_name",
+    "player_id",
+    "player_name",
+    "team_id",
+    "team_name",
+    "opponent_id",
+    "opponent_name",
+    "opponent_team_id",
+    "opponent_team_name",
+    "teammate_id",
+    "teammate_name",
+    "half",
+    "second",
+    "pos_x",
+    "pos_y",
+    "possession_id",
+    "possession_name",
+    "possession_team_id",
+    "possession_team_name",
+    "possession_number",
+    "possession_start_clear",
+    "possession_end_clear",
+    "playtype",
+    "hand",
+    "shot_type",
+    "drive",
+    "dribble_move",
+    "contesting",
+    "ts",
+]
+
+# `player_id` / `teammate_id` stay strings to match `ActionAnnotation`
+_INT_COLUMNS = [
+    "id",
+    "team_id",
+    "opponent_id",
+    "opponent_team_id",
+    "half",
+    "possession_id",
+    "possession_team_id",
+    "possession_number",
+]
+_FLOAT_COLUMNS = ["second", "pos_x", "pos_y", "possession_start_clear"]
+
+HUDL_DTYPES = {
+    **{col: "string" for col in HUDL_COLUMNS},
+    **{col: "Int64" for col in _INT_COLUMNS},
+    **{col: "float64" for col in _FLOAT_COLUMNS},
+    "action_name": "category",
+}
+
+# HUDL actions that never become clips
+IGNORED_ACTIONS = [
+    "Start of the offensive possession",
+    "Shooting guard",
+    "Guard",
+    "Center",
+    "Power forward",
+    "Forward",
+    "Timeout",
+    "Halftime",
+    "2nd quarter",
+    "Starting lineup",
+    "3rd quarter",
+    "1st quarter",
+    "4th quarter",
+    "Match end",
+    "Game stop",
+    "Ball in play",
+    "Error leading to goal",
+    "Accurate pass",
+]
+
+# seconds a clip extends past the logged event, and its length
+DEFAULT_EXTEND_TIME = 3.5
+FREETHROW_EXTEND_TIME = 4.5
+TURNOVER_EXTEND_TIME = 2.5
+CLIP_DURATION = 10
+
+# default on-disk cache of parsed logs
+HUDL_CACHE_DIR = "./hudl-cache"
+
+# bump when `read_hudl_log` changes in a way the columns and dtypes don't capture
+HUDL_LOADER_VERSION = 1
+
+# parsed logs of this process, keyed by `cache_key`
+_memory_cache: Dict[str, "pd.DataFrame"] = {}
+
+
+def find_hudl_log(log_path: str, game_id: int) -> Optional[str]:
+    """
+    Path of the log file for `game_id` in `log_path`, or `None` if there is none.
+    """
+
+    log_file = next((log for log in os.listdir(log_path) if str(game_id) in log), None)
+    return os.path.join(log_path, log_file) if log_file else None
+
+
+def file_hash(file_path: str) -> str:
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(file_path: str) -> str:
+    """
+    Cache key of a parsed log: the csv contents plus everything that shapes the parsed frame.
+    """
+
+    import pandas as pd
+
+    loader = f"{HUDL_LOADER_VERSION}:{pd.__version__}:{HUDL_COLUMNS}:{sorted(HUDL_DTYPES.items())}"
+    return hashlib.sha1(f"{file_hash(file_path)}:{loader}".encode("utf-8")).hexdigest()
+
+
+@timed("hudl_parse")
+def read_hudl_log(file_path: str) -> "pd.DataFrame":
+    """
+    Parse a HUDL csv without any caching.
+    """
+
+    import pandas as pd
+
+    count("hudl_logs_parsed")
+    return pd.read_csv(
+        file_path,
+        skiprows=1,
+        delimiter=";",
+        header=None,
+        names=HUDL_COLUMNS,
+        dtype=HUDL_DTYPES,
+    )
+
+
+def load_hudl_log(file_path: str, cache_dir: Optional[str] = HUDL_CACHE_DIR) -> "pd.DataFrame":
+    """
+    Load a HUDL log, going through the in-memory and on-disk caches.
+    Pass `cache_dir=None` to skip the disk cache. Callers must not mutate the result.
+    """
+
+    import pandas as pd
+
+    key = cache_key(file_path)
+    if key in _memory_cache:
+        return _memory_cache[key]
+
+    cache_file = os.path.join(cache_dir, f"{key}.pkl") if cache_dir else None
+    if cache_file and os.path.exists(cache_file):
+        log_df = pd.read_pickle(cache_file)
+    else:
+        log_df = read_hudl_log(file_path)
+        if cache_file:
+            os.makedirs(cache_dir, exist_ok=True)
+            # concurrent workers never read a partial pickle
+            write_atomic(cache_file, pickle.dumps(log_df, protocol=pickle.HIGHEST_PROTOCOL))
+
+    _memory_cache[key] = log_df
+    return log_df
+
+
+def load_game_log(log_path: str, game_id: int, cache_dir: Optional[str] = HUDL_CACHE_DIR) -> Optional["pd.DataFrame"]:
+    """
+    Cached log for `game_id`, or `None` if the game has no log file.
+    """
+
+    log_file = find_hudl_log(log_path, game_id)
+    if log_file is None:
+        return None
+    return load_hudl_log(log_file, cache_dir)
+
+
+def known_actions(log_df: "pd.DataFrame") -> "pd.DataFrame":
+    """
+    Rows whose `action_name` is one of `ActionName`.
+    """
+
+    return log_df[log_df["action_name"].isin([action.value for action in ActionName])]
+
+
+def clip_events(log_df: "pd.DataFrame", period: int, ignore: List[str] = IGNORED_ACTIONS) -> "pd.DataFrame":
+    """
+    Events of `period` that become clips, with `player_id` / `player_name` swapped for the
+    teammate on assists and `start_time` / `duration` of the clip added.
+    Mirrors the row loop in `run_job`: an extend time set by a free throw or turnover
+    carries over to the following events of the quarter.
+    """
+
+    import pandas as pd
+
+    events = log_df[
+        (log_df["half"] == period).fillna(False)
+        & ~log_df["action_name"].isin(ignore)
+        & log_df["second"].notna()
+        & log_df["player_name"].notna()
+    ]
+    action_name = events["action_name"].astype("string")
+    assisting = action_name == "Assisting"
+    events = events[~assisting | events["teammate_id"].notna()].copy()
+    action_name = events["action_name"].astype("string")
+    assisting = (action_name == "Assisting").to_numpy(dtype=bool)
+
+    events.loc[assisting, "player_id"] = events.loc[assisting, "teammate_id"]
+    events.loc[assisting, "player_name"] = events.loc[assisting, "teammate_name"]
+
+    extend_time = pd.Series(np.nan, index=events.index)
+    extend_time[~assisting & (action_name == "Turnover").to_numpy(dtype=bool)] = TURNOVER_EXTEND_TIME
+    extend_time[~assisting & action_name.str.contains("1", regex=False).to_numpy(dtype=bool)] = FREETHROW_EXTEND_TIME
+    extend_time = extend_time.ffill().fillna(DEFAULT_EXTEND_TIME)
+
+    events["start_time"] = events["second"] + extend_time
+    events["duration"] = CLIP_DURATION
+    return events
+
+
+def _field_kind(annotation) -> type:
+    kinds = [arg for arg in get_args(annotation) if arg is not type(None)] or [annotation]
+    return kinds[0]
+
+
+_FIELD_DTYPES = {int: "Int64", float: "float64", str: "string"}
+
+
+@timed("action_annotations")
+def action_annotations_from_df(log_df: "pd.DataFrame") -> List[ActionAnnotation]:
+    """
+    Build one `ActionAnnotation` per row in a single column-wise pass.
+    Every field is coerced to its model type and missing / empty values become `None`
+    per column, so the models are constructed without per-row validation.
+    """
+
+    import pandas as pd
+
+    columns = {}
+    for name, field in ActionAnnotation.model_fields.items():
+        if name not in log_df:
+            continue
+        series = log_df[name]
+        if pd.api.types.is_string_dtype(series) or isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.astype("string")
+            series = series.mask(series == "")
+        series = series.astype(_FIELD_DTYPES[_field_kind(field.annotation)])
+        columns[name] = series.astype(object).where(series.notna(), None).tolist()
+
+    names = list(columns)
+    return [ActionAnnotation.model_construct(**dict(zip(names, values))) for values in zip(*columns.values())]
@@ -0,0 +1,289 @@
+"""
+Shared, immutable keypoint schemas. `Keypoints` payloads only carry numeric data and
+refer to their schema by id, so names and skeletons are never copied per bbox.
+"""
+
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Tuple, Mapping
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class KeypointSchema:
+    """
+    Keypoint names and skeleton edges for a pose format. `edge_src` / `edge_dst` are
+    read-only index arrays into the keypoint axis, used to gather limb endpoints for
+    all bboxes of a frame at once.
+    """
+
+    schema_id: str
+    keypoint_names: Tuple[str, ...]
+    skeleton: Tuple[Tuple[int, int], ...]
+    edge_src: np.ndarray = field(init=False, repr=False, compare=False)
+    edge_dst: np.ndarray = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        edges = np.array(self.skeleton, dtype=np.intp).reshape(-1, 2)
+        edges.setflags(write=False)
+        object.__setattr__(self, "edge_src", edges[:, 0])
+        object.__setattr__(self, "edge_dst", edges[:, 1])
+
+    @property
+    def num_keypoints(self) -> int:
+        return len(self.keypoint_names)
+
+    def index(self, name: str) -> int:
+        return self.keypoint_names.index(name)
+
+
+# Annotations given by: https://github.com/jin-s13/COCO-WholeBody/blob/master/data_format.md
+_COCO_WHOLEBODY_KEYPOINTS = (
+    "nose",
+    "left_eye",
+    "right_eye",
+    "left_ear",
+    "right_ear",
+    "left_shoulder",
+    "right_shoulder",
+    "left_elbow",
+    "right_elbow",
+    "left_wrist",
+    "right_wrist",
+    "left_hip",
+    "right_hip",
+    "left_knee",
+    "right_knee",
+    "left_ankle",
+    "right_ankle",
+    "left_big_toe",
+    "left_small_toe",
+    "left_heel",
+    "right_big_toe",
+    "right_small_toe",
+    "right_heel",
+    "face-0",
+    "face-1",
+    "face-2",
+    "face-3",
+    "face-4",
+    "face-5",
+    "face-6",
+    "face-7",
+    "face-8",
+    "face-9",
+    "face-10",
+    "face-11",
+    "face-12",
+    "face-13",
+    "face-14",
+    "face-15",
+    "face-16",
+    "face-17",
+    "face-18",
+    "face-19",
+    "face-20",
+    "face-21",
+    "face-22",
+    "face-23",
+    "face-24",
+    "face-25",
+    "face-26",
+    "face-27",
+    "face-28",
+    "face-29",
+    "face-30",
+    "face-31",
+    "face-32",
+    "face-33",
+    "face-34",
+    "face-35",
+    "face-36",
+    "face-37",
+    "face-38",
+    "face-39",
+    "face-40",
+    "face-41",
+    "face-42",
+    "face-43",
+    "face-44",
+    "face-45",
+    "face-46",
+    "face-47",
+    "face-48",
+    "face-49",
+    "face-50",
+    "face-51",
+    "face-52",
+    "face-53",
+    "face-54",
+    "face-55",
+    "face-56",
+    "face-57",
+    "face-58",
+    "face-59",
+    "face-60",
+    "face-61",
+    "face-62",
+    "face-63",
+    "face-64",
+    "face-65",
+    "face-66",
+    "face-67",
+    "left_hand_root",
+    "left_thumb1",
+    "left_thumb2",
+    "left_thumb3",
+    "left_thumb4",
+    "left_forefinger1",
+    "left_forefinger2",
+    "left_forefinger3",
+    "left_forefinger4",
+    "left_middle_finger1",
+    "left_middle_finger2",
+    "left_middle_finger3",
+    "left_middle_finger4",
+    "left_ring_finger1",
+    "left_ring_finger2",
+    "left_ring_finger3",
+    "left_ring_finger4",
+    "left_pinky_finger1",
+    "left_pinky_finger2",
+    "left_pinky_finger3",
+    "left_pinky_finger4",
+    "right_hand_root",
+    "right_thumb1",
+    "right_thumb2",
+    "right_thumb3",
+    "right_thumb4",
+    "right_forefinger1",
+    "right_forefinger2",
+    "right_forefinger3",
+    "right_forefinger4",
+    "right_middle_finger1",
+    "right_middle_finger2",
+    "right_middle_finger3",
+    "right_middle_finger4",
+    "right_ring_finger1",
+    "right_ring_finger2",
+    "right_ring_finger3",
+    "right_ring_finger4",
+    "right_pinky_finger1",
+    "right_pinky_finger2",
+    "right_pinky_finger3",
+    "right_pinky_finger4",
+)
+
+_COCO_WHOLEBODY_SKELETON = (
+    (15, 13),
+    (13, 11),
+    (16, 14),
+    (14, 12),
+    (11, 12),
+    (5, 11),
+    (6, 12),
+    (5, 6),
+    (5, 7),
+    (6, 8),
+    (7, 9),
+    (8, 10),
+    (1, 2),
+    (0, 1),
+    (0, 2),
+    (1, 3),
+    (2, 4),
+    (3, 5),
+    (4, 6),
+    (15, 17),
+    (15, 18),
+    (15, 19),
+    (16, 20),
+    (16, 21),
+    (16, 22),
+    (91, 92),
+    (92, 93),
+    (93, 94),
+    (94, 95),
+    (91, 96),
+    (96, 97),
+    (97, 98),
+    (98, 99),
+    (91, 100),
+    (100, 101),
+    (101, 102),
+    (102, 103),
+    (91, 104),
+    (104, 105),
+    (105, 106),
+    (106, 107),
+    (91, 108),
+    (108, 109),
+    (109, 110),
+    (110, 111),
+    (112, 113),
+    (113, 114),
+    (114, 115),
+    (115, 116),
+    (112, 117),
+    (117, 118),
+    (118, 119),
+    (119, 120),
+    (112, 121),
+    (121, 122),
+    (122, 123),
+    (123, 124),
+    (112, 125),
+    (125, 126),
+    (126, 127),
+    (127, 128),
+    (112, 129),
+    (129, 130),
+    (130, 131),
+    (131, 132),
+)
+
+COCO_WHOLEBODY = KeypointSchema(
+    schema_id="coco_wholebody",
+    keypoint_names=_COCO_WHOLEBODY_KEYPOINTS,
+    skeleton=_COCO_WHOLEBODY_SKELETON,
+)
+
+KEYPOINT_SCHEMAS: Mapping[str, KeypointSchema] = MappingProxyType({COCO_WHOLEBODY.schema_id: COCO_WHOLEBODY})
+
+
+def get_schema(schema_id: str) -> KeypointSchema:
+    """
+    Look up a registered schema by id.
+    """
+
+    if schema_id not in KEYPOINT_SCHEMAS:
+        raise KeyError(f"Unknown keypoint schema: {schema_id}")
+    return KEYPOINT_SCHEMAS[schema_id]
+
+
+def skeleton_segments(keypoints: np.ndarray, schema: KeypointSchema = COCO_WHOLEBODY, min_score: float = 0.0) -> np.ndarray:
+    """
+    Gather limb endpoints for every bbox in one go.
+    `keypoints` is (n_bboxes, n_keypoints, 3) as (x, y, score); returns an
+    (n_segments, 2, 2) array of visible limbs, ready for `cv2.polylines`.
+    A limb is dropped if either endpoint is NaN or scores below `min_score`.
+    """
+
+    keypoints = np.asarray(keypoints, dtype=np.float64).reshape(-1, schema.num_keypoints, 3)
+    src = keypoints[:, schema.edge_src]
+    dst = keypoints[:, schema.edge_dst]
+    visible = (src[..., 2] >= min_score) & (dst[..., 2] >= min_score)
+    visible &= ~(np.isnan(src).any(axis=-1) | np.isnan(dst).any(axis=-1))
+    return np.stack([src[..., :2], dst[..., :2]], axis=-2)[visible]
+
+
+def limb_lengths(keypoints: np.ndarray, schema: KeypointSchema = COCO_WHOLEBODY) -> np.ndarray:
+    """
+    Euclidean length of every skeleton edge for every bbox, shape (n_bboxes, n_edges).
+    Limbs with a missing endpoint are NaN.
+    """
+
+    keypoints = np.asarray(keypoints, dtype=np.float64).reshape(-1, schema.num_keypoints, 3)
+    delta = keypoints[:, schema.edge_src, :2] - keypoints[:, schema.edge_dst, :2]
+    return np.linalg.norm(delta, axis=-1)
@@ -0,0 +1,285 @@
+"""
+Single entry point for the whole dataset build.
+The pipeline is a DAG per replay (quarter):
+
+    2d-player-positions + player-tracklets -> annotations -> clip-annotations
+    game-replays + hudl-game-logs          -> clips
+
+Tasks of different quarters are independent, so clip annotation of one game starts as
+soon as its quarter annotations exist instead of waiting for the whole dataset.
+
+    python pipeline.py --data-dir /path/to/data --workers 16
+    python pipeline.py --config build.json --stages annotations clip-annotations
+"""
+
+import os
+import argparse
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from pydantic import BaseModel, field_validator
+from tqdm import tqdm
+
+import profiling
+
+STAGES = ("annotations", "clip-annotations", "clips")
+
+# stage -> stages of the same quarter that must finish first
+DEPENDENCIES = {
+    "annotations": (),
+    "clip-annotations": ("annotations",),
+    "clips": (),
+}
+
+
+class PipelineConfig(BaseModel):
+    """
+    All paths and knobs of a pipeline run. Relative paths resolve against `data_dir`.
+    """
+
+    data_dir: str = "."
+    replays_dir: str = "game-replays"
+    logs_dir: str = "hudl-game-logs"
+    annotations_dir: str = "annotations"
+    clip_annotations_dir: str = "clip-annotations"
+    clips_dir: str = "clips"
+    hudl_cache_dir: str = "hudl-cache"
+    probe_cache_dir: str = "probe-cache"
+    run_log: str = "run-log.jsonl"
+    profile_dir: str = "profiles"
+    # `PROFILER[:STAGE,...]`, see `profiling`
+    profile: Optional[str] = None
+    stages: List[str] = list(STAGES)
+    games: Optional[List[int]] = None
+    workers: int = os.cpu_count() or 1
+    virtual: bool = False
+    # build quarters in chunks so each worker stays within `memory_limit_mb`, see `chunking`
+    chunked: bool = False
+    memory_limit_mb: int = 2048
+
+    @field_validator("stages")
+    @classmethod
+    def known_stages(cls, v):
+        unknown = [stage for stage in v if stage not in STAGES]
+        if unknown:
+            raise ValueError(f"Unknown stages {unknown}, expected some of {list(STAGES)}")
+        return v
+
+    @field_validator("profile")
+    @classmethod
+    def known_profiler(cls, v):
+        if v and v.partition(":")[0] not in profiling.PROFILERS:
+            raise ValueError(f"Unknown profiler in {v!r}, expected one of {list(profiling.PROFILERS)}")
+        return v
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.data_dir, getattr(self, name))
+
+
+class Task(NamedTuple):
+    stage: str
+    video_file: str
+
+
+def quarter_replays(config: PipelineConfig) -> List[str]:
+    """
+    Replays to process, ordered by game so a game's quarters run back to back.
+    """
+
+    videos = [video for video in os.listdir(config.path("replays_dir")) if video.endswith(".mp4")]
+    if config.games is not None:
+        games = set(config.games)
+        videos = [video for video in videos if int(video.split("_")[0]) in games]
+    return sorted(videos, key=lambda video: (int(video.split("_")[0]), video))
+
+
+def build_dag(video_files: List[str], stages: List[str]) -> Dict[Task, Tuple[Task, ...]]:
+    """
+    Map every task to the tasks it waits on. Dependencies on stages that are not run are
+    dropped, their outputs are expected to exist already.
+    """
+
+    dag = {}
+    for video_file in video_files:
+        for stage in stages:
+            deps = tuple(Task(dep, video_file) for dep in DEPENDENCIES[stage] if dep in stages)
+            dag[Task(stage, video_file)] = deps
+    return dag
+
+
+def run_task(task: Task, config: PipelineConfig) -> bool:
+    """
+    Run one stage for one quarter. Executed in a worker process.
+    """
+
+    from hudl_logs import IGNORED_ACTIONS
+
+    try:
+        with profiling.timed(f"pipeline:{task.stage}"):
+            if task.stage == "annotations":
+                from chunking import chunk_frames_for
+                from construct_annotations import construct_quarter_annotation
+
+                chunk_frames = chunk_frames_for(config.memory_limit_mb << 20) if config.chunked else None
+                return construct_quarter_annotation(
+                    task.video_file,
+                    config.path("replays_dir"),
+                    config.path("annotations_dir"),
+                    config.data_dir,
+                    chunk_frames=chunk_frames,
+                )
+
+            if task.stage == "clip-annotations":
+                from annotation_io import AnnotationWriter
+                from annotate_clips import process_video_annotations
+
+                with AnnotationWriter() as writer:
+                    process_video_annotations(
+                        config.path("replays_dir"),
+                        task.video_file,
+                        config.path("logs_dir"),
+                        config.path("annotations_dir"),
+                        config.path("clip_annotations_dir"),
+                        IGNORED_ACTIONS,
+                        writer,
+                        hudl_cache_dir=config.path("hudl_cache_dir"),
+                        probe_cache_dir=config.path("probe_cache_dir"),
+                    )
+                return True
+
+            if task.stage == "clips":
+                from run_job import extract_video_clips
+
+                return extract_video_clips(
+                    task.video_file,
+                    config.path("replays_dir"),
+                    config.path("logs_dir"),
+                    config.path("clips_dir"),
+                    IGNORED_ACTIONS,
+                    config.virtual,
+                    config.path("hudl_cache_dir"),
+                    config.path("probe_cache_dir"),
+                ) is not False
+
+            raise ValueError(f"Unknown stage: {task.stage}")
+    finally:
+        # pool workers don't run atexit hooks, flush after every task
+        profiling.write_summary()
+
+
+def _priority(task: Task, order: Dict[str, int]) -> Tuple[int, int]:
+    # downstream stages first so finished games drain, then by game
+    return (-len(DEPENDENCIES[task.stage]), order[task.video_file])
+
+
+def run_dag(dag: Dict[Task, Tuple[Task, ...]], config: PipelineConfig) -> Dict[Task, bool]:
+    """
+    Run every task once its dependencies succeeded, keeping at most `config.workers`
+    tasks in flight. Tasks whose dependencies failed are skipped and reported as failed.
+    """
+
+    order = {video_file: i for i, video_file in enumerate(dict.fromkeys(task.video_file for task in dag))}
+    dependents: Dict[Task, List[Task]] = {task: [] for task in dag}
+    remaining = {task: len(deps) for task, deps in dag.items()}
+    for task, deps in dag.items():
+        for dep in deps:
+            dependents[dep].append(task)
+
+    ready = [task for task, n in remaining.items() if n == 0]
+    results: Dict[Task, bool] = {}
+    running: Dict[Future, Task] = {}
+    pbar = tqdm(total=len(dag))
+
+    def finish(task: Task, ok: bool):
+        results[task] = ok
+        pbar.update(1)
+        for dependent in dependents[task]:
+            if not ok:
+                if dependent not in results:
+                    print(f"Skipping {dependent.stage} for {dependent.video_file}: {task.stage} failed")
+                    finish(dependent, False)
+                continue
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                ready.append(dependent)
+
+    with ProcessPoolExecutor(max_workers=config.workers) as pool:
+        while ready or running:
+            ready.sort(key=lambda task: _priority(task, order))
+            while ready and len(running) < config.workers:
+                task = ready.pop(0)
+                if task not in results:
+                    running[pool.submit(run_task, task, config)] = task
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                try:
+                    ok = bool(future.result())
+                except Exception as e:
+                    print(f"Failed {task.stage} for {task.video_file}: {e}")
+                    ok = False
+                finish(task, ok)
+
+    pbar.close()
+    return results
+
+
+def parse_args(argv: Optional[List[str]] = None) -> PipelineConfig:
+    parser = argparse.ArgumentParser(description="Build the NBA dense dataset.")
+    parser.add_argument("--config", help="JSON file with `PipelineConfig` fields, overridden by flags")
+    parser.add_argument("--data-dir")
+    parser.add_argument("--replays-dir")
+    parser.add_argument("--logs-dir")
+    parser.add_argument("--annotations-dir")
+    parser.add_argument("--clip-annotations-dir")
+    parser.add_argument("--clips-dir")
+    parser.add_argument("--hudl-cache-dir")
+    parser.add_argument("--probe-cache-dir")
+    parser.add_argument("--stages", nargs="+", choices=STAGES)
+    parser.add_argument("--games", nargs="+", type=int)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--virtual", action="store_true", default=None, help="don't cut clip MP4s")
+    parser.add_argument("--chunked", action="store_true", default=None, help="build quarter annotations in chunks")
+    parser.add_argument("--memory-limit-mb", type=int, help="per-worker memory budget of a chunked quarter")
+    parser.add_argument("--run-log")
+    parser.add_argument("--profile-dir")
+    parser.add_argument("--profile", help="profile stages, PROFILER[:STAGE,...], e.g. cprofile:ffprobe,write_chunks")
+    args = vars(parser.parse_args(argv))
+
+    config = {}
+    config_file = args.pop("config")
+    if config_file:
+        with open(config_file, "r") as f:
+            config = PipelineConfig.model_validate_json(f.read()).model_dump(exclude_unset=True)
+    config.update({key: value for key, value in args.items() if value is not None})
+    return PipelineConfig(**config)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    config = parse_args(argv)
+    # exported through the env so worker processes log and profile to the same place
+    os.environ["PIPELINE_RUN_LOG"] = config.path("run_log")
+    os.environ["PIPELINE_PROFILE_DIR"] = config.path("profile_dir")
+    if config.profile:
+        os.environ["PIPELINE_PROFILE"] = config.profile
+    profiling.configure_from_env()
+
+    for name in ("annotations_dir", "clip_annotations_dir", "clips_dir"):
+        os.makedirs(config.path(name), exist_ok=True)
+
+    dag = build_dag(quarter_replays(config), config.stages)
+    results = run_dag(dag, config)
+
+    failed = [task for task, ok in results.items() if not ok]
+    for stage in config.stages:
+        n_failed = sum(task.stage == stage for task in failed)
+        print(f"{stage}: {sum(task.stage == stage for task in results) - n_failed} done, {n_failed} failed")
+    profiling.write_summary()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
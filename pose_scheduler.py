@@ -0,0 +1,215 @@
+"""
+Clip-only pose estimation. Clip windows of a quarter overlap heavily, so rather than
+running a pose model over the whole replay (or once per clip), the windows are merged
+into disjoint frame ranges, each range is decoded once, and bbox crops are fed to the
+estimator in batches. Keypoints are written back into the quarter's `FrameStore`, which
+surfaces them as `Bbox.keypoints`.
+"""
+
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+from annot_types import VideoAnnotation, FrameStore
+from clip_planner import group_windows
+from frame_timing import FrameClock
+from profiling import timed, count
+from keypoint_schemas import COCO_WHOLEBODY, KeypointSchema
+
+
+class PoseEstimator(ABC):
+    """
+    Interface for CPU pose models. `predict` receives a batch of BGR crops (one per bbox,
+    any size) and returns a (n_crops, n_keypoints, 3) array of (x, y, score) in crop pixels.
+    """
+
+    schema: KeypointSchema = COCO_WHOLEBODY
+    batch_size: int = 32
+
+    @abstractmethod
+    def predict(self, crops: List[np.ndarray]) -> np.ndarray:
+        ...
+
+
+class StubPoseEstimator(PoseEstimator):
+    """
+    Deterministic placeholder for dry runs of the pipeline without a pose model: every
+    keypoint is placed at the crop center with full confidence. Records the size of each
+    batch it was given.
+    """
+
+    def __init__(self, batch_size: int = 32):
+        self.batch_size = batch_size
+        self.batch_sizes: List[int] = []
+
+    def predict(self, crops: List[np.ndarray]) -> np.ndarray:
+        self.batch_sizes.append(len(crops))
+        keypoints = np.ones((len(crops), self.schema.num_keypoints, 3))
+        for i, crop in enumerate(crops):
+            keypoints[i, :, 0] = crop.shape[1] / 2
+            keypoints[i, :, 1] = crop.shape[0] / 2
+        return keypoints
+
+
+def merge_frame_ranges(windows: np.ndarray, gap: int = 0, num_frames: Optional[int] = None) -> List[Tuple[int, int]]:
+    """
+    Merge `[start, end)` windows into the minimal list of disjoint, sorted ranges.
+    Windows separated by at most `gap` frames are merged too, which is cheaper than
+    seeking when the gap is small. Windows are clipped to `[0, num_frames)`; clips of
+    events early in a quarter start at negative frames.
+    """
+
+    windows = np.asarray(windows, dtype=np.int64).reshape(-1, 2)
+    windows = np.clip(windows, 0, num_frames)
+    windows = windows[windows[:, 1] > windows[:, 0]]
+    ranges, _ = group_windows(windows, gap)
+    return [(int(start), int(end)) for start, end in ranges]
+
+
+def decode_frame_ranges(
+    video_path: str,
+    ranges: Sequence[Tuple[int, int]],
+    clock: Optional[FrameClock] = None,
+) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Yield `(frame_idx, frame)` for every frame in `ranges`, seeking once per range.
+    Ranges are clamped to the frames of the video, seeking to a negative frame would
+    land on frame 0 and mislabel every frame after it. With a `clock` holding the replay's
+    frame timestamps, each range is seeked by timestamp and decoded frames are labelled
+    by their own timestamp, since OpenCV's frame positions assume a constant frame rate.
+    """
+
+    import cv2
+
+    cap = cv2.VideoCapture(video_path)
+    assert cap.isOpened(), f"Failed to open {video_path}"
+    timed_seek = clock is not None and len(clock) > 0
+    num_frames = len(clock) if timed_seek else int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or None
+    try:
+        for start, end in ranges:
+            start = max(start, 0)
+            end = end if num_frames is None else min(end, num_frames)
+            if start >= end:
+                continue
+            if not timed_seek:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+                for frame_idx in range(start, end):
+                    ret, frame = cap.read()
+                    if not ret:
+                        break
+                    yield frame_idx, frame
+                continue
+
+            cap.set(cv2.CAP_PROP_POS_MSEC, clock.frame_times[start] * 1000)
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                frame_idx = int(clock.frame_at(cap.get(cv2.CAP_PROP_POS_MSEC) / 1000))
+                if frame_idx >= end:
+                    break
+                if frame_idx >= start:
+                    yield frame_idx, frame
+    finally:
+        cap.release()
+
+
+def _crop_boxes(frame: np.ndarray, bboxes: np.ndarray) -> Tuple[List[np.ndarray], np.ndarray, np.ndarray]:
+    """
+    Crops of every bbox, clipped to the frame. Returns the crops, the (x0, y0) origin of
+    each crop and a mask of bboxes that have a non-empty crop.
+    """
+
+    height, width = frame.shape[:2]
+    x0 = np.clip(np.floor(bboxes[:, 2]), 0, width).astype(np.int64)
+    y0 = np.clip(np.floor(bboxes[:, 3]), 0, height).astype(np.int64)
+    x1 = np.clip(np.ceil(bboxes[:, 2] + bboxes[:, 4]), 0, width).astype(np.int64)
+    y1 = np.clip(np.ceil(bboxes[:, 3] + bboxes[:, 5]), 0, height).astype(np.int64)
+    valid = (x1 > x0) & (y1 > y0)
+    crops = [frame[y0[i] : y1[i], x0[i] : x1[i]] for i in np.flatnonzero(valid)]
+    return crops, np.stack([x0, y0], axis=1)[valid], valid
+
+
+@timed("pose_estimation")
+def estimate_poses(
+    video_path: str,
+    store: FrameStore,
+    ranges: Sequence[Tuple[int, int]],
+    estimator: PoseEstimator,
+    clock: Optional[FrameClock] = None,
+) -> int:
+    """
+    Run `estimator` on every bbox of `store` inside `ranges` and write the keypoints,
+    in frame pixels, into `store.keypoints`. Returns the number of bboxes processed.
+    `clock` is passed on to `decode_frame_ranges`.
+    """
+
+    if store.keypoints is None:
+        store.keypoints = np.full((len(store.bboxes), estimator.schema.num_keypoints, 3), np.nan)
+        store.schema_id = estimator.schema.schema_id
+    assert store.schema_id == estimator.schema.schema_id, f"{store.schema_id} keypoints can't hold {estimator.schema.schema_id} estimates"
+
+    # one entry per crop: the crop, its (x0, y0) origin and its bbox row in `store`
+    crops: List[np.ndarray] = []
+    origins: List[np.ndarray] = []
+    rows: List[int] = []
+    processed = 0
+
+    def flush(n: int):
+        nonlocal processed
+        if n == 0:
+            return
+        with timed("pose_model"):
+            keypoints = np.asarray(estimator.predict(crops[:n]), dtype=np.float64).copy()
+        offsets = np.stack(origins[:n])
+        keypoints[:, :, 0] += offsets[:, None, 0]
+        keypoints[:, :, 1] += offsets[:, None, 1]
+        store.keypoints[rows[:n]] = keypoints
+        processed += n
+        count("pose_bboxes", n)
+        del crops[:n], origins[:n], rows[:n]
+
+    for frame_idx, frame in decode_frame_ranges(video_path, ranges, clock):
+        idx = store.index_of(frame_idx)
+        if idx is None:
+            continue
+        lo, hi = store.bbox_offsets[idx], store.bbox_offsets[idx + 1]
+        if hi == lo:
+            continue
+
+        frame_crops, frame_origins, valid = _crop_boxes(frame, store.bboxes[lo:hi])
+        crops.extend(frame_crops)
+        origins.extend(frame_origins)
+        rows.extend(np.arange(lo, hi)[valid].tolist())
+        # a frame's crops may be split across batches, every batch is exactly `batch_size`
+        while len(crops) >= estimator.batch_size:
+            flush(estimator.batch_size)
+    flush(len(crops))
+
+    return processed
+
+
+def annotate_clip_poses(
+    video_path: str,
+    video_annotation: VideoAnnotation,
+    events: "pd.DataFrame",
+    estimator: PoseEstimator,
+    clock: FrameClock,
+    gap: int = 0,
+) -> VideoAnnotation:
+    """
+    Estimate poses for every frame covered by a clip of `events` in one pass over the
+    quarter. Returns an annotation backed by a `FrameStore` that only holds the frames of
+    those clips, so keypoints are allocated for their bboxes rather than the whole quarter
+    (or chunk, which is sized without keypoints, see `chunking.frame_bytes`).
+    """
+
+    video_annotation = video_annotation.to_frame_store()
+    ranges = merge_frame_ranges(clock.clip_windows(events), gap)
+    store = video_annotation.frames.select(ranges)
+    estimate_poses(video_path, store, ranges, estimator, clock)
+    return video_annotation.model_copy(update={"frames": store})
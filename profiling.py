@@ -0,0 +1,209 @@
+"""
+Lightweight instrumentation shared by all pipeline scripts.
+- `timed("stage")` works as a context manager or decorator and accumulates wall / cpu time per stage
+- `count("frames", n)` accumulates counters (frames, bboxes, events, bytes, ...)
+- stages listed in the profile config are additionally captured with cProfile or pyinstrument
+Totals are appended as one JSON line per process to the run log by `write_summary`, which
+also runs at exit. Configure with `configure(...)` or, for Ray workers and other child
+processes, the `PIPELINE_RUN_LOG` / `PIPELINE_PROFILE` env vars,
+e.g. `PIPELINE_PROFILE=cprofile:split_video_annotation,ffmpeg` (`*` profiles every stage).
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+from collections import defaultdict
+from contextlib import ContextDecorator
+from typing import Dict, Iterable, Optional
+
+PROFILERS = ("cprofile", "pyinstrument")
+
+DEFAULT_RUN_LOG = "./run-log.jsonl"
+
+
+class _State:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.run_log: Optional[str] = None
+        self.profiler: Optional[str] = None
+        self.profile_stages: frozenset = frozenset()
+        self.profile_dir = "./profiles"
+        self.timings: Dict[str, list] = defaultdict(lambda: [0, 0.0, 0.0])
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.profile_ids: Dict[str, int] = defaultdict(int)
+        self.local = threading.local()
+        self.started = time.time()
+
+
+_state = _State()
+
+
+def configure(
+    run_log: Optional[str] = None,
+    profiler: Optional[str] = None,
+    profile_stages: Iterable[str] = (),
+    profile_dir: str = "./profiles",
+):
+    """
+    Set where the summary is written and which stages are profiled. Settings are exported
+    as env vars so processes started afterwards pick them up.
+    """
+
+    assert profiler is None or profiler in PROFILERS, f"Unknown profiler: {profiler}"
+    _state.run_log = run_log
+    _state.profiler = profiler
+    _state.profile_stages = frozenset(profile_stages)
+    _state.profile_dir = profile_dir
+
+    if run_log:
+        os.environ["PIPELINE_RUN_LOG"] = run_log
+    if profiler:
+        os.environ["PIPELINE_PROFILE"] = f"{profiler}:{','.join(sorted(_state.profile_stages))}"
+        os.environ["PIPELINE_PROFILE_DIR"] = profile_dir
+
+
+def configure_from_env():
+    profiler, profile_stages = None, ()
+    if os.environ.get("PIPELINE_PROFILE"):
+        profiler, _, stages = os.environ["PIPELINE_PROFILE"].partition(":")
+        profile_stages = [stage for stage in stages.split(",") if stage] or ["*"]
+    configure(
+        os.environ.get("PIPELINE_RUN_LOG"),
+        profiler,
+        profile_stages,
+        os.environ.get("PIPELINE_PROFILE_DIR", "./profiles"),
+    )
+
+
+def enable_run_log(run_log: str = DEFAULT_RUN_LOG):
+    """
+    Write summaries to `run_log` unless a run log is already configured.
+    """
+
+    if not _state.run_log:
+        _state.run_log = run_log
+        os.environ["PIPELINE_RUN_LOG"] = run_log
+
+
+def count(name: str, n: int = 1):
+    with _state.lock:
+        _state.counters[name] += int(n)
+
+
+class timed(ContextDecorator):
+    """
+    Time a stage. Nested stages are recorded independently, so an outer stage includes
+    the time of its inner ones.
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._local = threading.local()
+
+    def _should_profile(self) -> bool:
+        if _state.profiler is None:
+            return False
+        if "*" not in _state.profile_stages and self.stage not in _state.profile_stages:
+            return False
+        # only one profiler can be active per thread
+        return not getattr(_state.local, "profiling", False)
+
+    def __enter__(self):
+        frames = getattr(self._local, "frames", [])
+        self._local.frames = frames
+        profiler = _start_profiler() if self._should_profile() else None
+        frames.append((time.perf_counter(), time.thread_time(), profiler))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall_start, cpu_start, profiler = self._local.frames.pop()
+        wall = time.perf_counter() - wall_start
+        cpu = time.thread_time() - cpu_start
+        if profiler is not None:
+            _stop_profiler(profiler, self.stage)
+
+        with _state.lock:
+            timing = _state.timings[self.stage]
+            timing[0] += 1
+            timing[1] += wall
+            timing[2] += cpu
+        return False
+
+
+def _start_profiler():
+    _state.local.profiling = True
+    if _state.profiler == "pyinstrument":
+        from pyinstrument import Profiler
+
+        profiler = Profiler()
+        profiler.start()
+        return profiler
+
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def _stop_profiler(profiler, stage: str):
+    _state.local.profiling = False
+    with _state.lock:
+        _state.profile_ids[stage] += 1
+        profile_id = _state.profile_ids[stage]
+
+    os.makedirs(_state.profile_dir, exist_ok=True)
+    base = os.path.join(_state.profile_dir, f"{stage}-{os.getpid()}-{profile_id}")
+    if _state.profiler == "pyinstrument":
+        profiler.stop()
+        with open(f"{base}.html", "w") as f:
+            f.write(profiler.output_html())
+    else:
+        profiler.disable()
+        profiler.dump_stats(f"{base}.prof")
+
+
+def summary() -> dict:
+    with _state.lock:
+        return {
+            "pid": os.getpid(),
+            "argv": sys.argv,
+            "started": _state.started,
+            "elapsed": time.time() - _state.started,
+            "stages": {
+                stage: {"calls": calls, "wall": wall, "cpu": cpu}
+                for stage, (calls, wall, cpu) in sorted(_state.timings.items())
+            },
+            "counters": dict(sorted(_state.counters.items())),
+        }
+
+
+def write_summary():
+    """
+    Append this process' totals to the run log, if one is configured, and reset them.
+    """
+
+    if not _state.run_log:
+        return
+    record = summary()
+    if not record["stages"] and not record["counters"]:
+        return
+
+    log_dir = os.path.dirname(_state.run_log)
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+    # a single short append per process, safe to share the log between workers
+    with open(_state.run_log, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+    with _state.lock:
+        _state.timings.clear()
+        _state.counters.clear()
+        _state.started = time.time()
+
+
+configure_from_env()
+atexit.register(write_summary)
@@ -0,0 +1,228 @@
+"""
+Batched overlay rendering for review videos. Every annotation type of a frame is
+drawn with a single OpenCV call over a stacked array instead of one call per object.
+"""
+
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from annot_types import VideoAnnotation, FrameStore, Tracklet
+from keypoint_schemas import COCO_WHOLEBODY, KeypointSchema, skeleton_segments
+
+# BGR colors
+BBOX_COLOR = (0, 255, 0)
+SKELETON_COLOR = (255, 128, 0)
+BALL_COLOR = (0, 165, 255)
+TEAM_COLORS = ((0, 0, 255), (255, 0, 0))
+
+# statvu court dimensions (feet)
+COURT_LENGTH = 100.0
+COURT_WIDTH = 50.0
+
+# sentinel passed down the decode -> draw -> encode queues
+_DONE = object()
+
+
+def bbox_contours(bboxes: np.ndarray) -> np.ndarray:
+    """
+    Corners of every bbox as an (n_bboxes, 4, 1, 2) int32 array for `cv2.drawContours`.
+    `bboxes` rows are laid out as `BBOX_COLUMNS`.
+    """
+
+    x, y, w, h = (bboxes[:, i] for i in range(2, 6))
+    corners = np.stack([np.stack([x, y], -1), np.stack([x + w, y], -1), np.stack([x + w, y + h], -1), np.stack([x, y + h], -1)], axis=1)
+    return np.rint(corners).astype(np.int32).reshape(-1, 4, 1, 2)
+
+
+def tracklet_positions(tracklet: Optional[Tracklet]) -> np.ndarray:
+    """
+    StatVU positions of a tracklet as an (n, 3) array of (x, y, team_id).
+    """
+
+    if tracklet is None:
+        return np.empty((0, 3))
+    return np.array(
+        [[pos.x_position, pos.y_position, pos.team_id] for pos in tracklet.moment.player_positions],
+        dtype=np.float64,
+    ).reshape(-1, 3)
+
+
+def court_to_image(positions: np.ndarray, frame_shape: Tuple[int, ...], homography: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Project court (x, y) positions into pixel coordinates.
+    With a `homography` (court -> image) the positions are drawn on the court itself,
+    otherwise they are mapped onto a minimap in the top-right corner of the frame.
+    """
+
+    xy = np.asarray(positions, dtype=np.float64)[:, :2]
+    if len(xy) == 0:
+        return np.empty((0, 2), dtype=np.int32)
+    if homography is not None:
+        projected = cv2.perspectiveTransform(xy.reshape(-1, 1, 2), np.asarray(homography, dtype=np.float64))
+        return np.rint(projected.reshape(-1, 2)).astype(np.int32)
+
+    origin, scale = _minimap_geometry(frame_shape)
+    return np.rint(origin + xy * scale).astype(np.int32)
+
+
+def _minimap_geometry(frame_shape: Tuple[int, ...]) -> Tuple[np.ndarray, float]:
+    height, width = frame_shape[:2]
+    scale = 0.25 * width / COURT_LENGTH
+    origin = np.array([width - COURT_LENGTH * scale - 10, 10])
+    return origin, scale
+
+
+def draw_annotations(
+    frame: np.ndarray,
+    bboxes: Optional[np.ndarray] = None,
+    keypoints: Optional[np.ndarray] = None,
+    positions: Optional[np.ndarray] = None,
+    homography: Optional[np.ndarray] = None,
+    schema: KeypointSchema = COCO_WHOLEBODY,
+    min_score: float = 0.3,
+) -> np.ndarray:
+    """
+    Draw bboxes, keypoint skeletons and StatVU positions on `frame` in place.
+    - bboxes: (n_bboxes, 7) laid out as `BBOX_COLUMNS`
+    - keypoints: (n_bboxes, n_keypoints, 3), NaN rows are skipped
+    - positions: (n, 3) as (x, y, team_id) in court coordinates
+    """
+
+    if bboxes is not None and len(bboxes):
+        cv2.drawContours(frame, list(bbox_contours(bboxes)), -1, BBOX_COLOR, 2)
+
+    if keypoints is not None and len(keypoints):
+        segments = skeleton_segments(keypoints, schema, min_score)
+        if len(segments):
+            cv2.polylines(frame, list(np.rint(segments).astype(np.int32)), False, SKELETON_COLOR, 1, cv2.LINE_AA)
+
+    if positions is not None and len(positions):
+        if homography is None:
+            origin, scale = _minimap_geometry(frame.shape)
+            court = np.rint([origin, origin + [COURT_LENGTH * scale, COURT_WIDTH * scale]]).astype(np.int32)
+            cv2.rectangle(frame, tuple(court[0]), tuple(court[1]), (255, 255, 255), 1)
+
+        points = court_to_image(positions, frame.shape, homography)
+        team_ids = positions[:, 2]
+        teams = np.unique(team_ids[team_ids >= 0])
+        groups = [(team_ids == -1, BALL_COLOR)]
+        groups += [(team_ids == team, TEAM_COLORS[i % len(TEAM_COLORS)]) for i, team in enumerate(teams)]
+        for mask, color in groups:
+            if mask.any():
+                # a closed single-point polyline with round caps renders as a filled dot
+                cv2.polylines(frame, list(points[mask].reshape(-1, 1, 2)), True, color, 8, cv2.LINE_AA)
+
+    return frame
+
+
+def _frame_overlays(store: FrameStore, frame_id: int):
+    idx = store.index_of(frame_id)
+    if idx is None:
+        return None, None, None
+    bboxes, keypoints = store.frame_arrays(idx)
+    return bboxes, keypoints, tracklet_positions(store.tracklet_at(idx))
+
+
+def _run_stage(fn, inbox: queue.Queue, outbox: Optional[queue.Queue], errors: List[BaseException]):
+    try:
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                break
+            result = fn(item)
+            if outbox is not None:
+                outbox.put(result)
+    except BaseException as e:
+        errors.append(e)
+        # keep draining so upstream stages never block on a full queue
+        while inbox.get() is not _DONE:
+            pass
+    finally:
+        if outbox is not None:
+            outbox.put(_DONE)
+
+
+def render_clip(
+    video_path: str,
+    annotation: VideoAnnotation,
+    output_path: str,
+    homography: Optional[np.ndarray] = None,
+    queue_size: int = 32,
+) -> int:
+    """
+    Render `annotation` over `video_path` into `output_path`.
+    Decoding, drawing and encoding run on separate threads connected by bounded
+    queues, so OpenCV's codec work overlaps with drawing. Returns the number of frames written.
+    """
+
+    store = annotation.to_frame_store().frames
+    cap = cv2.VideoCapture(video_path)
+    assert cap.isOpened(), f"Failed to open {video_path}"
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+
+    decoded, drawn = queue.Queue(queue_size), queue.Queue(queue_size)
+    errors: List[BaseException] = []
+    written = 0
+
+    def draw(item):
+        frame_idx, frame = item
+        bboxes, keypoints, positions = _frame_overlays(store, frame_idx)
+        return draw_annotations(frame, bboxes, keypoints, positions, homography)
+
+    def encode(frame):
+        nonlocal written
+        writer.write(frame)
+        written += 1
+
+    drawer = threading.Thread(target=_run_stage, args=(draw, decoded, drawn, errors), daemon=True)
+    encoder = threading.Thread(target=_run_stage, args=(encode, drawn, None, errors), daemon=True)
+    drawer.start()
+    encoder.start()
+
+    try:
+        frame_idx = 0
+        while not errors:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            decoded.put((frame_idx, frame))
+            frame_idx += 1
+    finally:
+        decoded.put(_DONE)
+        drawer.join()
+        encoder.join()
+        cap.release()
+        writer.release()
+
+    if errors:
+        raise Exception(f"Failed to render {output_path}: {errors[0]}") from errors[0]
+    return written
+
+
+def render_clips(jobs: Iterable[Tuple[str, str, str]], output_folder: str, num_workers: int = 4) -> List[str]:
+    """
+    Render preview videos for many `(video_path, annotation_path, output_name)` jobs.
+    Each clip already runs a three-stage pipeline; `num_workers` clips are rendered at once.
+    """
+
+    os.makedirs(output_folder, exist_ok=True)
+
+    def render(job):
+        video_path, annotation_path, output_name = job
+        with open(annotation_path, "r") as f:
+            annotation = VideoAnnotation.model_validate_json(f.read())
+        output_path = os.path.join(output_folder, output_name)
+        render_clip(video_path, annotation, output_path)
+        return output_path
+
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        return list(pool.map(render, jobs))
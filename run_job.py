@@ -1,102 +1,87 @@
 import os
-import pandas as pd
 import numpy as np
 from tqdm import tqdm
-import ray
-import logging
-
-columns = [
-    'id', 'action_id', 'action_name', 'player_id', 'player_name',
-    'team_id', 'team_name', 'opponent_id', 'opponent_name',
-    'opponent_team_id', 'opponent_team_name', 'teammate_id',
-    'teammate_name', 'half', 'second', 'pos_x', 'pos_y',
-    'possession_id', 'possession_name', 'possession_team_id',
-    'possession_team_name', 'possession_number', 'possession_start_clear',
-    'possession_end_clear', 'playtype', 'hand', 'shot_type',
-    'drive', 'dribble_move', 'contesting', 'ts'
-]
-
-ray.init(configure_logging=True, logging_level=logging.ERROR)
-
-@ray.remote
-def process_video(video, video_path, log_path, save_path, ignore):
+from hudl_logs import load_game_log, clip_events, IGNORED_ACTIONS, HUDL_CACHE_DIR
+from clip_planner import extract_clips
+from frame_timing import PROBE_CACHE_DIR
+import profiling
+
+def extract_video_clips(video, video_path, log_path, save_path, ignore, virtual=False, hudl_cache_dir=HUDL_CACHE_DIR, probe_cache_dir=PROBE_CACHE_DIR):
     if video == '.DS_Store':
         return
 
+    # no-op when PIPELINE_RUN_LOG reached this worker
+    profiling.enable_run_log()
+
+    # virtual clips are served from the replay itself, see `virtual_clips`
+    if virtual:
+        return True
+
     game_id = int(video.split('_')[0])
     period_id = video.split('_')[6].split('.')[0]
     curr_video = os.path.join(video_path, video)
     
-    log_file = next((log for log in os.listdir(log_path) if str(game_id) in log), None)
-    if log_file is None:
+    log_df = load_game_log(log_path, game_id, hudl_cache_dir)
+    if log_df is None:
         return False
 
-    log_df = pd.read_csv(os.path.join(log_path, log_file), skiprows=1, delimiter=';', header=None, names=columns)
-
-    extend_time = 3.5
-
     period = int(video[-5])
-    for index, row in log_df.iterrows():
-        if int(row['half']) != period:
-            continue
-
-        if row['action_name'] not in ignore and not pd.isna(row['second']) and not pd.isna(row['player_name']):
-            if row['action_name'] == 'Assisting':
-                if pd.isna(row['teammate_id']):
-                    continue
-                player_id = int(row['teammate_id'])
-                player_name = row['teammate_name']
-                duration = 10
-            else:
-                if '1' in row['action_name']:
-                    extend_time = 4.5
-                elif row['action_name'] == 'Turnover':
-                    extend_time = 2.5
-                player_id = int(row['player_id'])
-                player_name = row['player_name']
-                duration = 10
-            
-            start_time = float(row['second']) + extend_time
-
-            output_folder = os.path.join(save_path, str(game_id), str(period_id))
-            os.makedirs(output_folder, exist_ok=True)
-
-            output_path = os.path.join(output_folder, f"{game_id}_{period_id}_{row['action_name']}_{row['id']}.mp4")
-
-            if not os.path.exists(output_path):
-                os.system(
-                    f'ffmpeg -ss {start_time - duration} -t {duration} -hide_banner -loglevel error -n -i "{curr_video}" -vcodec copy -acodec copy "{output_path}"')
-
-            if not os.path.exists(output_path):
-                with open(f'{game_id}_failed_videos.txt', 'a+') as f:
-                    f.write(f'{curr_video}\n')
-                return False
+    events = clip_events(log_df, period, ignore)
+
+    output_folder = os.path.join(save_path, str(game_id), str(period_id))
+    os.makedirs(output_folder, exist_ok=True)
+
+    output_paths = np.array([
+        os.path.join(output_folder, f"{game_id}_{period_id}_{row.action_name}_{row.id}.mp4")
+        for row in events[['id', 'action_name']].itertuples(index=False)
+    ], dtype=object)
+    windows = np.stack([events['start_time'] - events['duration'], events['start_time']], axis=1)
+
+    # overlapping clips are trimmed from a shared super-segment instead of each seeking into the quarter
+    missing = np.array([not os.path.exists(path) for path in output_paths], dtype=bool)
+    profiling.count('clips', int(missing.sum()))
+    with profiling.timed('extract_clips'):
+        extract_clips(curr_video, windows[missing], list(output_paths[missing]), probe_cache_dir)
+    # ray workers are long lived, flush this task's timings now
+    profiling.write_summary()
+
+    if not all(os.path.exists(path) for path in output_paths):
+        with open(f'{game_id}_failed_videos.txt', 'a+') as f:
+            f.write(f'{curr_video}\n')
+        return False
 
     return True
 
 
-if __name__ == "__main__":
-    video_path = './game-replays'
-    log_path = './hudl-game-logs'
-    save_path = f'./clips'
-    os.makedirs(save_path, exist_ok=True)
+def run_local(videos, video_path, log_path, save_path, ignore, virtual=False):
+    """
+    Extract the clips of every video in this process, returns the number of failures.
+    """
+    num_failed = 0
+    for video in tqdm(videos):
+        if extract_video_clips(video, video_path, log_path, save_path, ignore, virtual) == False:
+            num_failed += 1
+    return num_failed
 
-    ignore = ['Start of the offensive possession', 'Shooting guard', 'Guard', 'Center', 'Power forward', 'Forward',
-              'Timeout', 'Halftime', '2nd quarter', 'Starting lineup', '3rd quarter', '1st quarter', '4th quarter',
-              'Match end', 'Game stop', 'Ball in play']
-    
-    ignore.append('Error leading to goal')
-    ignore.append('Accurate pass')
 
-    videos = [video for video in os.listdir(video_path) if video != '.DS_Store']
-    
+def run_distributed(videos, video_path, log_path, save_path, ignore, virtual=False):
+    """
+    Extract the clips of every video as Ray tasks, returns the number of failures.
+    Ray is only imported and started here.
+    """
+    import ray
+    import logging
+
+    ray.init(configure_logging=True, logging_level=logging.ERROR)
+    process_video = ray.remote(extract_video_clips)
+
     pbar = tqdm(total=len(videos))
     video_path = ray.put(video_path)
     log_path = ray.put(log_path)
     ignore = ray.put(ignore)
     save_path = ray.put(save_path)
 
-    futures = [process_video.remote(video, video_path, log_path, save_path, ignore) for video in videos]
+    futures = [process_video.remote(video, video_path, log_path, save_path, ignore, virtual) for video in videos]
 
     num_failed = 0
     while len(futures):
@@ -108,6 +93,33 @@ if __name__ == "__main__":
                 print(f'# failed video: {num_failed}')
         pbar.update(len(dones))
 
-    print(f'Total # failed video: {num_failed}')
+    ray.shutdown()
+    return num_failed
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Cut the clips of every replay.")
+    # with virtual clips no clip MP4s are cut, clip annotations reference the replays
+    parser.add_argument('--virtual', action='store_true', help="don't cut clip MP4s, see `virtual_clips`")
+    # fan out over a Ray cluster, otherwise clips are extracted in this process
+    parser.add_argument('--local', action='store_true', help="run in this process without starting Ray")
+    args = parser.parse_args()
+
+    video_path = './game-replays'
+    log_path = './hudl-game-logs'
+    save_path = f'./clips'
+    profiling.enable_run_log()
+    virtual = args.virtual
+    distributed = not args.local
+    os.makedirs(save_path, exist_ok=True)
+
+    ignore = IGNORED_ACTIONS
 
-    ray.shutdown()
\ No newline at end of file
+    videos = [video for video in os.listdir(video_path) if video != '.DS_Store']
+
+    run = run_distributed if distributed else run_local
+    num_failed = run(videos, video_path, log_path, save_path, ignore, virtual)
+
+    print(f'Total # failed video: {num_failed}')
@@ -2,23 +2,22 @@ import json
 import cv2
 import os
 import random
+import numpy as np
 from typing import List
-from annot_types import VideoAnnotation, Bbox, Tracklet
+from annot_types import VideoAnnotation, Bbox, Tracklet, BBOX_COLUMNS
+from keypoint_schemas import COCO_WHOLEBODY
+from render_annotations import draw_annotations, tracklet_positions
 
 def draw_annotations_on_frame(frame, bboxes: List[Bbox], tracklet: Tracklet):
-    # Draw bounding boxes
-    for bbox in bboxes:
-        top_left = (int(bbox.x), int(bbox.y))
-        bottom_right = (int(bbox.x + bbox.width), int(bbox.y + bbox.height))
-        cv2.rectangle(frame, top_left, bottom_right, (0, 255, 0), 2)
-    
-    # Draw tracklet as a dot
-    # if tracklet:
-    #     for pos in tracklet.moment.player_positions:
-    #         center = (int(pos.x_position), int(pos.y_position))
-    #         cv2.circle(frame, center, 5, (0, 0, 255), -1)
-    
-    return frame
+    # stack everything so each annotation type is a single batched draw call
+    rows = np.array([[getattr(bbox, col) for col in BBOX_COLUMNS] for bbox in bboxes or []]).reshape(-1, len(BBOX_COLUMNS))
+    keypoints = None
+    if any(bbox.keypoints for bbox in bboxes or []):
+        keypoints = np.stack([
+            bbox.keypoints.to_array() if bbox.keypoints else np.full((COCO_WHOLEBODY.num_keypoints, 3), np.nan)
+            for bbox in bboxes
+        ])
+    return draw_annotations(frame, rows, keypoints, tracklet_positions(tracklet))
 
 def process_video_with_annotations(annotation_path, output_folder):
     with open(annotation_path, 'r') as f:
@@ -45,8 +44,8 @@ def process_video_with_annotations(annotation_path, output_folder):
             break
 
         if frame_idx in sampled_frame_indices:
-            if frame_idx < len(video_annotation.frames):
-                frame_annotation = video_annotation.frames[frame_idx]
+            frame_annotation = video_annotation.frame(frame_idx)
+            if frame_annotation is not None:
                 frame = draw_annotations_on_frame(frame, frame_annotation.bbox, frame_annotation.tracklet)
             
             # Save frame as image
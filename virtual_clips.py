@@ -0,0 +1,122 @@
+"""
+Virtual clips: serve the frames of a clip annotation straight from its full-quarter
+replay instead of a cut MP4. Keyframe positions of every replay are probed once with
+ffprobe (packet headers only, nothing is decoded) and cached, so a clip read seeks to
+the closest keyframe and decodes forward from there.
+"""
+
+import os
+from typing import Iterator, Optional
+
+import cv2
+import numpy as np
+
+from annot_types import VideoAnnotation
+from frame_timing import PROBE_CACHE_DIR, load_frame_times, load_packets, probe_packets
+
+
+def probe_keyframes(video_path: str) -> np.ndarray:
+    """
+    Presentation-order indices of every keyframe of the first video stream.
+    Returns an empty array if ffprobe is unavailable or fails.
+    """
+
+    _, keyframe = probe_packets(video_path)
+    return np.flatnonzero(keyframe).astype(np.int64)
+
+
+def load_keyframe_index(video_path: str, cache_dir: Optional[str] = PROBE_CACHE_DIR) -> np.ndarray:
+    """
+    Keyframe indices of `video_path`, from the probe cache shared with `frame_timing`.
+    """
+
+    _, keyframe = load_packets(video_path, cache_dir)
+    return np.flatnonzero(keyframe).astype(np.int64)
+
+
+class VirtualClipReader:
+    """
+    Random and sequential access to the frames of a virtual clip.
+    Frame `i` of the clip is frame `start_frame + i` of the source replay.
+    """
+
+    def __init__(self, annotation: VideoAnnotation, video_dir: str = "./game-replays", cache_dir: Optional[str] = PROBE_CACHE_DIR):
+        assert annotation.is_virtual, f"{annotation.video_path} does not reference a source replay"
+        self.video_path = os.path.join(video_dir, annotation.source_path)
+        self.start_frame = annotation.start_frame
+        self.end_frame = annotation.end_frame
+        self.keyframes = load_keyframe_index(self.video_path, cache_dir)
+        # from the same cached probe as the keyframes, used to seek by timestamp
+        self.frame_times = load_frame_times(self.video_path, cache_dir)
+        self._cap = cv2.VideoCapture(self.video_path)
+        assert self._cap.isOpened(), f"Failed to open {self.video_path}"
+        # source index of the frame the next `read` returns
+        self._position = 0
+
+    def __len__(self) -> int:
+        return max(self.end_frame - self.start_frame, 0)
+
+    def _seek(self, source_idx: int):
+        """
+        Position the decoder so the next read returns `source_idx`. Seeks only when
+        the target is behind the decoder or a keyframe lies between the two, otherwise
+        decoding forward is cheaper.
+        """
+
+        if source_idx < 0:
+            raise IndexError(f"Frame {source_idx} is before the start of {self.video_path}")
+
+        if len(self.keyframes):
+            k = int(np.searchsorted(self.keyframes, source_idx, side="right")) - 1
+            keyframe = int(self.keyframes[k]) if k >= 0 else 0
+            if source_idx < self._position or keyframe > self._position:
+                # OpenCV frame positions assume a constant frame rate, timestamps don't
+                self._cap.set(cv2.CAP_PROP_POS_MSEC, self.frame_times[keyframe] * 1000)
+                self._position = keyframe
+        elif source_idx != self._position:
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, source_idx)
+            self._position = source_idx
+
+        while self._position < source_idx:
+            if not self._cap.grab():
+                raise IndexError(f"Frame {source_idx} is past the end of {self.video_path}")
+            self._position += 1
+
+    def _read(self) -> np.ndarray:
+        ret, frame = self._cap.read()
+        if not ret:
+            raise IndexError(f"Frame {self._position} is past the end of {self.video_path}")
+        self._position += 1
+        return frame
+
+    def __getitem__(self, idx: int) -> np.ndarray:
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("VirtualClipReader index out of range")
+        self._seek(self.start_frame + idx)
+        return self._read()
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        yield from self.frames()
+
+    def frames(self, start: int = 0, end: Optional[int] = None) -> Iterator[np.ndarray]:
+        """
+        Clip frames `[start, end)`, with a single seek.
+        """
+
+        end = len(self) if end is None else min(end, len(self))
+        if start >= end:
+            return
+        self._seek(self.start_frame + start)
+        for _ in range(start, end):
+            yield self._read()
+
+    def close(self):
+        self._cap.release()
+
+    def __enter__(self) -> "VirtualClipReader":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()